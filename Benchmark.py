@@ -0,0 +1,319 @@
+''' Benchmarks for method loading, extent generation, peals and the scheduler, written out as JSON
+
+  python Benchmark.py --output bench.json
+  python Benchmark.py --baseline bench.json
+
+Timings are the best of a few repeats. With --baseline the results are compared with an
+earlier run and anything that has got more than 20% (and 1ms) slower is listed.
+
+Every quarter and peal in the methods is also checked, whatever the baseline: it has to
+be true, build and prove in under PEAL_BUILD_S, not take much more memory than its rows,
+and ringing them all back to back through a small ExtentCache must not hold on to more
+memory session after session. Anything that fails is listed and the exit code is 1.
+'''
+import os
+import gc
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from Methods import Method, Extent
+from MethodCache import MethodCache
+from ExtentCache import ExtentCache
+from Scheduler import Scheduler
+import PlaceNotation
+import Truth
+
+def best_of(repeat, fn, *args):
+  ''' Shortest time of repeat calls of fn and what it returned '''
+  best = None
+  for ndx in range(repeat):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+def bench_method_loading(files, repeat):
+  ''' Parsing every .mcf from scratch and then from a warm MethodCache '''
+  cold, methods = best_of(repeat, lambda: [Method(file) for file in files])
+  with tempfile.TemporaryDirectory() as directory:
+    cache = MethodCache(os.path.join(directory, 'methods.cache'))
+    for file in files:
+      cache.method(file)
+    cache.save()
+    warm, loaded = best_of(repeat, lambda: [MethodCache(os.path.join(directory, 'methods.cache')).method(file) for file in files])
+  return {'files': len(files), 'cold_s': cold, 'warm_s': warm}
+
+def _build(method, key, cover):
+  return len(Extent(method, key, cover = cover).compact())
+
+def bench_extents(files, repeat):
+  ''' Generating every extent of every method in full, with and without cover '''
+  results = {}
+  for file in files:
+    method = Method(file)
+    for cover in (False, True):
+      if cover and not method.coverable():
+        continue
+      rows = 0
+      seconds = 0.0
+      extent_id = 1
+      while method.extent_exists(extent_id):
+        # Mutable extents are shuffled the same way every run
+        random.seed(extent_id)
+        elapsed, built = best_of(repeat, _build, method, 'EXTENT-' + str(extent_id), cover)
+        rows += built
+        seconds += elapsed
+        extent_id += 1
+      results['{}{}'.format(method.name, ' with cover' if cover else '')] = {
+        'extents': extent_id - 1, 'rows': rows, 'build_s': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+  return results
+
+def plain_bob(bells, rows, directory):
+  ''' Write a Plain Bob .mcf for any number of bells with one long touch of at least rows rows '''
+  back = PlaceNotation.BELL_SYMBOLS[bells - 1]
+  if bells % 2 == 0:
+    notation, bob, single = 'x1' + back, 'x14', 'x1234'
+    notation = notation * (bells // 2) + ',12'
+  else:
+    notation = '.'.join([back, '1'] * ((bells - 1) // 2)) + '.' + back + ',12' + back
+    # The bob makes 4ths, the single 3rds and 4ths too (just 3rds on five as 4ths and 5ths are the back)
+    bob = back + '.14' + back
+    single = back + ('.123' if bells == 5 else '.1234' + back)
+  leads = -(-rows // (bells * 2))
+  definition = ('PPPPB' * leads)[:leads]
+  file = os.path.join(directory, 'Plain Bob {}.mcf'.format(bells))
+  with open(file, 'w') as f:
+    f.write('[INFO]\nname=Plain Bob on {}\nbells={}\ncoverable=No\n\n'.format(bells, bells))
+    f.write('[PLACE_NOTATION]\nMETHOD={}\nBOB={}\nSINGLE={}\n\n'.format(notation, bob, single))
+    f.write('[EXTENT-1]\nNAME:Synthetic\nLENGTH:{}\nDEFINITION:{}\n'.format(leads * bells * 2, definition))
+  return file
+
+def bench_stages(stages, rows, repeat):
+  ''' Rows per second generating peal length touches, walking the rows as the ringing loop does '''
+  results = {}
+  with tempfile.TemporaryDirectory() as directory:
+    for bells in stages:
+      method = Method(plain_bob(bells, rows, directory))
+      def ring():
+        count = 0
+        for row in Extent(method, 'EXTENT-1', cover = False):
+          for strike in row.positions:
+            count += 1
+        return count
+      elapsed, strikes = best_of(repeat, ring)
+      results[str(bells)] = {'rows': strikes // bells, 'ring_s': elapsed,
+                             'rows_per_second': strikes / bells / elapsed, 'strikes_per_second': strikes / elapsed}
+  return results
+
+# Limits for the quarters and peals, the build is the pause between choosing one and Look to
+PEAL_BUILD_S = 0.25
+# Peak memory building one, as bytes per bell per row plus a fixed allowance
+PEAL_BYTES_PER_BELL = 4
+PEAL_PEAK_KB = 64
+# Small enough that ringing them all in turn has the cache dropping extents
+PEAL_CACHE_ROWS = 20000
+PEAL_GROWTH_KB = 16
+
+def peals(files, rows = 1250):
+  ''' (method, extent key, cover) of every extent at least rows long (a quarter peal), with and without cover '''
+  found = []
+  for file in files:
+    method = Method(file)
+    extent_id = 1
+    while method.extent_exists(extent_id):
+      key = 'EXTENT-' + str(extent_id)
+      if method.extent_length(key) * method.extent_courses(key) >= rows:
+        for cover in (False, True) if method.coverable() else (False, ):
+          found.append((method, key, cover))
+      extent_id += 1
+  return found
+
+def _ring_peal(extents, method, key, cover):
+  ''' What a session does with the extent, fetch it from the cache and walk every row '''
+  extent, truth = extents.extent(method, key, cover)
+  count = 0
+  for row in extent:
+    count += len(row.positions)
+  return count
+
+def bench_peals(files, repeat, sessions = 3):
+  ''' The pause building and proving each quarter and peal, the memory it takes, and whether back
+  to back sessions ringing them all in turn through one ExtentCache keep hold of any more memory '''
+  found = peals(files)
+  results = {}
+  for method, key, cover in found:
+    build = lambda: Truth.prove(Extent(method, key, cover = cover).precompute())
+    elapsed, truth = best_of(repeat, build)
+    tracemalloc.start()
+    extent = Extent(method, key, cover = cover).precompute()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['{} {}{}'.format(method.name, method.extent_name(key), ' with cover' if cover else '')] = {
+      'rows': len(extent), 'bells': extent.number_of_bells, 'true': truth.true() if truth.provable else None, 'build_s': elapsed,
+      'kept_kb': size / 1024, 'peak_kb': peak / 1024}
+  if not found:
+    return results
+
+  extents = ExtentCache(max_rows = PEAL_CACHE_ROWS)
+  tracemalloc.start()
+  retained = []
+  most_rows = 0
+  for session in range(sessions):
+    for method, key, cover in found:
+      _ring_peal(extents, method, key, cover)
+      most_rows = max(most_rows, extents.rows())
+    gc.collect()
+    retained.append(tracemalloc.get_traced_memory()[0])
+  tracemalloc.stop()
+  results['sessions'] = {'sessions': sessions, 'peals': len(found), 'max_rows': PEAL_CACHE_ROWS, 'most_cached_rows': most_rows,
+                         'retained_kb': retained[0] / 1024, 'growth_kb': (retained[-1] - retained[0]) / 1024}
+  return results
+
+def peal_failures(results):
+  ''' What is wrong with the quarters and peals in bench_peals results, empty if nothing '''
+  failures = []
+  for name, peal in results.items():
+    if name == 'sessions':
+      continue
+    if peal['true'] is False:
+      failures.append('{} is false'.format(name))
+    if peal['build_s'] > PEAL_BUILD_S:
+      failures.append('{} took {:.3f}s to build and prove, more than {}s'.format(name, peal['build_s'], PEAL_BUILD_S))
+    limit = peal['rows'] * peal['bells'] * PEAL_BYTES_PER_BELL / 1024 + PEAL_PEAK_KB
+    if peal['peak_kb'] > limit:
+      failures.append('{} took {:.0f}KB to build, more than {:.0f}KB'.format(name, peal['peak_kb'], limit))
+  sessions = results.get('sessions')
+  if sessions:
+    # Only the one just added can take the cache over max_rows, and a peal on its own fits
+    if sessions['most_cached_rows'] > sessions['max_rows']:
+      failures.append('The extent cache held {} rows, more than its max_rows of {}'.format(sessions['most_cached_rows'], sessions['max_rows']))
+    if sessions['growth_kb'] > PEAL_GROWTH_KB:
+      failures.append('Memory grew by {:.0f}KB over {} sessions'.format(sessions['growth_kb'], sessions['sessions']))
+  return failures
+
+class FakeClock():
+  ''' A clock that only moves when slept on, each sleep overshoots by a random amount like a real one '''
+  def __init__(self, overshoot, stall_every = 0, stall = 0.0):
+    self.now = 0.0
+    self.sleeps = 0
+    self._overshoot = overshoot
+    self._stall_every = stall_every
+    self._stall = stall
+    self._random = random.Random(1)
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.sleeps += 1
+    self.now += seconds + self._random.uniform(0, self._overshoot)
+    if self._stall_every and self.sleeps % self._stall_every == 0:
+      self.now += self._stall
+
+def bench_scheduler(strikes, bells = 8, pace = 2.4):
+  ''' How late the scheduler strikes and how far it drifts on a fake clock with sleep overshoot and stalls '''
+  results = {}
+  for name, clock in (('overshoot', FakeClock(0.002)),
+                      ('stalls', FakeClock(0.002, stall_every = 500, stall = 0.5))):
+    scheduler = Scheduler(pace, bells, clock = clock.time, sleeper = clock.sleep)
+    scheduler.start()
+    start = time.perf_counter()
+    for ndx in range(strikes):
+      if ndx % (bells * 2) == 0:
+        scheduler.handstroke_gap()
+      scheduler.wait()
+    elapsed = time.perf_counter() - start
+    # Where the last strike should have been had nothing slipped, slot has already moved on past it
+    ideal = (scheduler.slot - 1) * pace / bells
+    results[name] = {'strikes': scheduler.strikes,
+                     'mean_lateness_ms': scheduler.mean_lateness() * 1000,
+                     'max_lateness_ms': scheduler.max_lateness * 1000,
+                     'late_strikes': scheduler.late_strikes,
+                     'slips': scheduler.slips,
+                     'drift_s': clock.now - ideal,
+                     'overhead_us_per_strike': elapsed / strikes * 1e6}
+  return results
+
+def bench_ringing_loop(bells = 8, rows = 1260, pace = 2.4, latency = 0.02):
+  ''' The whole AsyncTower ringing loop in simulated time against a server latency seconds away
+
+  Arrival error is when each strike reaches the server against when it was due, so it
+  shows how well the latency compensation is working
+  '''
+  # Only needed here, it brings in socketio
+  from Simulation import simulate
+  with tempfile.TemporaryDirectory() as directory:
+    method = Method(plain_bob(bells, rows, directory))
+    start = time.perf_counter()
+    tower = simulate(method, 'EXTENT-1', pace = pace, latency = latency)
+    elapsed = time.perf_counter() - start
+  errors = sorted(abs(e.at + latency - e.scheduled) for e in tower.strike_log.strikes())
+  return {'strikes': len(errors),
+          'simulate_s': elapsed,
+          'mean_arrival_error_ms': sum(errors) / len(errors) * 1000,
+          'p99_arrival_error_ms': errors[int(0.99 * (len(errors) - 1))] * 1000,
+          'lead_ms': tower.latency_stats()['lead'] * 1000}
+
+def run(files, repeat = 3, stages = range(5, 13), rows = 5040, strikes = 100000):
+  return {'python': platform.python_version(),
+          'platform': platform.platform(),
+          'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'method_loading': bench_method_loading(files, repeat),
+          'extents': bench_extents(files, repeat),
+          'stages': bench_stages(stages, rows, repeat),
+          'peals': bench_peals(files, repeat),
+          'scheduler': bench_scheduler(strikes),
+          'ringing_loop': bench_ringing_loop()}
+
+def regressions(results, baseline, tolerance = 0.2, floor = 0.001, path = ''):
+  ''' Timings (keys ending _s) that are more than tolerance slower than in the baseline,
+  and by at least floor seconds so the noise on the tiny ones is left out '''
+  slower = []
+  for key, value in results.items():
+    old = baseline.get(key) if isinstance(baseline, dict) else None
+    if old is None:
+      continue
+    if isinstance(value, dict):
+      slower += regressions(value, old, tolerance, floor, path + key + '/')
+    elif key.endswith('_s') and old > 0 and value > old * (1 + tolerance) and value - old > floor:
+      slower.append((path + key, old, value))
+  return slower
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Benchmark method loading, extent generation, peals and the scheduler')
+  parser.add_argument('files', nargs = '*', help = 'method .mcf files, all of data/ by default')
+  parser.add_argument('--repeat', type = int, default = 3)
+  parser.add_argument('--rows', type = int, default = 5040, help = 'length of the synthetic touches')
+  parser.add_argument('--output', default = None, help = 'write the results to this file rather than stdout')
+  parser.add_argument('--baseline', default = None, help = 'earlier results to compare with')
+  args = parser.parse_args()
+
+  files = args.files if args.files else sorted(glob.glob('./data/*.mcf'))
+  results = run(files, args.repeat, rows = args.rows)
+  text = json.dumps(results, indent = 2)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(text + '\n')
+  else:
+    print(text)
+
+  failures = peal_failures(results['peals'])
+  for failure in failures:
+    print(failure, file = sys.stderr)
+
+  slower = []
+  if args.baseline:
+    with open(args.baseline) as f:
+      slower = regressions(results, json.load(f))
+    for key, old, new in slower:
+      print('{}: {:.4f}s -> {:.4f}s'.format(key, old, new), file = sys.stderr)
+  sys.exit(1 if slower or failures else 0)
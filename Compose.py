@@ -0,0 +1,225 @@
+''' Searches for new true touches of a method and writes them out as [EXTENT-n] sections
+
+  python Compose.py "data/Plain Bob Minor.mcf" 100 300 --count 30
+  python Compose.py "data/Plain Bob Major.mcf" 5000 5200 --courses 3
+
+The search is a depth first walk through callings a lead at a time, abandoning a
+calling as soon as a lead repeats a row or the touch gets too long. The rows of each
+lead are worked out once for each lead head and kept, so the same lead met on a
+different branch costs a dict lookup. The calls at the first few leads are shared
+out between a pool of processes.
+
+With --courses the search is for one part of a multi part composition, the calling
+is rung that many times so a part has to end on a row that takes that many parts to
+come round, and every row of every part has to be different.
+'''
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from Methods import Method, Extent
+import Truth
+
+class LeadCache():
+  ''' The rows of every lead met so far, keyed on lead head and the calls either side '''
+  def __init__(self, method, calls):
+    self._method = method
+    self._bells = method.number_of_bells()
+    self._engine = method.default_engine(''.join(calls))
+    self._leads = {}
+
+  def lead(self, head, last_lead, lead):
+    key = (head, last_lead, lead)
+    entry = self._leads.get(key)
+    if entry is None:
+      table = self._method.lead_table(last_lead, lead, False, self._engine)
+      flat = bytes(table.gather(head))
+      rows = tuple(flat[ndx * self._bells:(ndx + 1) * self._bells] for ndx in range(table.length))
+      entry = (rows, rows[-1] if rows else head)
+      self._leads[key] = entry
+    return entry
+
+class Search():
+  def __init__(self, method, shortest, longest, calls, limit, deadline, courses = 1):
+    self._cache = LeadCache(method, calls)
+    self._rounds = bytes(range(1, method.number_of_bells() + 1))
+    self._shortest = shortest
+    self._longest = longest
+    self._calls = calls
+    self._limit = limit
+    self._deadline = deadline
+    self._courses = courses
+    self._used = set()
+    self._calling = []
+    # The rows of each lead of the calling, only kept to check the other parts
+    self._lead_rows = []
+    self.found = []
+
+  def run(self, prefix):
+    head = self._rounds
+    last_lead = Extent.LEAD_TYPE_PLAIN
+    length = 0
+    # Ring the prefix first, it has to be true on its own
+    for lead in prefix:
+      rows, head = self._cache.lead(head, last_lead, lead)
+      if not rows:
+        raise ValueError('{} in the prefix {} is a lead with no rows'.format(lead, prefix))
+      # Too long already, some of the other prefixes may still fit
+      if (length + len(rows)) * self._courses > self._longest:
+        return self.found
+      if not self._add(rows):
+        return self.found
+      length += len(rows)
+      last_lead = lead
+      self._calling.append(lead)
+      self._lead_rows.append(rows)
+      if head == self._rounds:
+        if self._courses == 1 and self._shortest <= length:
+          self.found.append((''.join(self._calling), length))
+        return self.found
+    self._search(head, last_lead, length)
+    return self.found
+
+  def _add(self, rows):
+    for ndx in range(len(rows)):
+      if rows[ndx] in self._used:
+        for row in rows[:ndx]:
+          self._used.discard(row)
+        return False
+      self._used.add(rows[ndx])
+    return True
+
+  def _search(self, head, last_lead, length):
+    for lead in self._calls:
+      if len(self.found) >= self._limit or time.monotonic() > self._deadline:
+        return
+      rows, next_head = self._cache.lead(head, last_lead, lead)
+      if not rows or (length + len(rows)) * self._courses > self._longest:
+        continue
+      if not self._add(rows):
+        continue
+      self._calling.append(lead)
+      self._lead_rows.append(rows)
+      if next_head == self._rounds:
+        # Come round, keep it if it's long enough but either way it can't go on
+        if self._courses == 1 and length + len(rows) >= self._shortest:
+          self.found.append((''.join(self._calling), length + len(rows)))
+      else:
+        if self._courses > 1 and (length + len(rows)) * self._courses >= self._shortest and self._parts_true(next_head):
+          self.found.append((''.join(self._calling), length + len(rows)))
+        self._search(next_head, lead, length + len(rows))
+      self._lead_rows.pop()
+      self._calling.pop()
+      for row in rows:
+        self._used.discard(row)
+
+  def _parts_true(self, part_end):
+    ''' Whether the parts after the first, each starting where the last ended, come round and are true '''
+    start = part_end
+    used = set()
+    for part in range(1, self._courses):
+      if start == self._rounds:
+        return False
+      for rows in self._lead_rows:
+        for row in rows:
+          row = bytes(start[bell - 1] for bell in row)
+          if row in self._used or row in used:
+            return False
+          used.add(row)
+      start = bytes(start[bell - 1] for bell in part_end)
+    return start == self._rounds
+
+def _search_prefix(args):
+  file, prefix, shortest, longest, calls, limit, deadline, courses = args
+  return Search(Method(file), shortest, longest, calls, limit, deadline, courses).run(prefix)
+
+def compose(file, shortest, longest, count = 24, calls = None, processes = None, seconds = 60.0, prefix_leads = None, courses = 1):
+  ''' Up to count true touches between shortest and longest rows long as (calling, length)
+
+  With courses more than one the calling is one part and the length is that of a part.
+  prefix_leads is how many leads each process starts from, as many as fit up to 3 if not given
+  '''
+  method = Method(file)
+  if calls is None:
+    calls = [Extent.LEAD_TYPE_PLAIN]
+    if method.lead_end(Extent.LEAD_TYPE_BOB) or method.place_notation.get('BOB'):
+      calls.append(Extent.LEAD_TYPE_BOB)
+    if method.lead_end(Extent.LEAD_TYPE_SINGLE) or method.place_notation.get('SINGLE'):
+      calls.append(Extent.LEAD_TYPE_SINGLE)
+
+  # The prefixes are rung before anything is checked so they have to make sense up front
+  engine = method.default_engine(''.join(calls))
+  lengths = [method.lead_table(Extent.LEAD_TYPE_PLAIN, lead, False, engine).length for lead in calls]
+  if min(lengths) == 0:
+    raise ValueError('{} leads of {} have no rows'.format(calls[lengths.index(0)], method.name))
+  if prefix_leads is None:
+    prefix_leads = max(1, min(3, longest // (min(lengths) * courses)))
+  if prefix_leads < 1 or prefix_leads * min(lengths) * courses > longest:
+    raise ValueError('A prefix of {} leads is at least {} rows, it has to be at least one lead and no longer than the longest touch of {}'.format(
+      prefix_leads, prefix_leads * min(lengths) * courses, longest))
+
+  # Each process takes a different start to the touch so the touches found are spread out
+  prefixes = [''.join(p) for p in itertools.product(calls, repeat = prefix_leads)]
+  limit = max(1, -(-count // len(prefixes)) * 2)
+  deadline = time.monotonic() + seconds
+  jobs = [(file, prefix, shortest, longest, calls, limit, deadline, courses) for prefix in prefixes]
+
+  touches = {}
+  with ProcessPoolExecutor(processes) as pool:
+    for found in pool.map(_search_prefix, jobs):
+      for calling, length in found:
+        touches[calling] = length
+
+  # Prove them again the slow way, just to be sure
+  touches = [(calling, length) for calling, length in touches.items() if Truth.prove_touch(method, calling, courses = courses).true()]
+  touches.sort(key = lambda t: (t[1], t[0]))
+  # Spread the ones kept over the range of lengths found
+  if len(touches) > count:
+    step = len(touches) / count
+    touches = [touches[int(ndx * step)] for ndx in range(count)]
+  return method, touches
+
+def extent_sections(method, touches, courses = 1):
+  ''' Text of the new [EXTENT-n] sections, numbered on from the extents already in the method '''
+  extent_id = 1
+  while method.extent_exists(extent_id):
+    extent_id += 1
+  text = ''
+  for calling, length in touches:
+    if courses > 1:
+      text += '\n[EXTENT-{}]\nNAME:{} {}-part {}\nLENGTH:{}\nDEFINITION:{}\nCOURSES:{}\n'.format(
+        extent_id, length * courses, courses, calling, length, calling, courses)
+    else:
+      text += '\n[EXTENT-{}]\nNAME:Touch of {} {}\nLENGTH:{}\nDEFINITION:{}\n'.format(extent_id, length, calling, length, calling)
+    extent_id += 1
+  return text
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Search for true touches of a method')
+  parser.add_argument('file', help = 'method .mcf file')
+  parser.add_argument('shortest', type = int, help = 'fewest rows in a touch')
+  parser.add_argument('longest', type = int, help = 'most rows in a touch')
+  parser.add_argument('--count', type = int, default = 24, help = 'how many touches to find')
+  parser.add_argument('--calls', default = None, help = 'lead types to use, for example PB')
+  parser.add_argument('--processes', type = int, default = None)
+  parser.add_argument('--seconds', type = float, default = 60.0, help = 'give up searching after this long')
+  parser.add_argument('--courses', type = int, default = 1, help = 'search for one part of a composition rung this many times')
+  parser.add_argument('--prefix-leads', type = int, default = None, help = 'leads each process starts from, as many as fit up to 3 by default')
+  parser.add_argument('--append', action = 'store_true', help = 'add the touches to the end of the method file')
+  args = parser.parse_args()
+
+  try:
+    method, touches = compose(args.file, args.shortest, args.longest, args.count,
+                              list(args.calls.upper()) if args.calls else None, args.processes, args.seconds,
+                              args.prefix_leads, args.courses)
+  except ValueError as e:
+    parser.error(str(e))
+  sections = extent_sections(method, touches, args.courses)
+  if args.append:
+    with open(args.file, 'a') as f:
+      f.write(sections)
+    print('Added {} touches to {}'.format(len(touches), args.file), file = sys.stderr)
+  else:
+    print(sections)
@@ -7,7 +7,8 @@ class Config():
   def __init__(self, ini = None):
     if not Config._config:
       Config._config = configparser.ConfigParser()
-      Config._config.read(ini)
+      # With no ini everything comes from the defaults
+      Config._config.read(ini if ini else [])
   
   def get(self, section, key, default = None):
     if default is None:
@@ -22,5 +23,20 @@ class Config():
       return Config._config.getint(section, key, fallback = default)
       
   
+  def getfloat(self, section, key, default = None):
+    if default is None:
+      return Config._config.getfloat(section, key)
+    else:
+      return Config._config.getfloat(section, key, fallback = default)
+  
+  def getboolean(self, section, key, default = None):
+    if default is None:
+      return Config._config.getboolean(section, key)
+    else:
+      return Config._config.getboolean(section, key, fallback = default)
+  
+  def has_section(self, section):
+    return Config._config.has_section(section)
+  
   def items(self, section):
     return Config._config.items(section)
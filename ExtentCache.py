@@ -0,0 +1,110 @@
+import itertools
+from random import randrange, choice, sample
+from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Methods import Extent
+import Truth
+
+class ExtentCache():
+  ''' Extents already generated and proved, ready to be rung again
+
+  Keyed on the method file, extent, cover and the rotation of each section of a mutable
+  extent. Only a bounded number are kept, and no more than max_rows rows between them
+  so a few peals can't take up as much room as a lot of touches, the least recently
+  used is dropped when another is added. Every rotation of a mutable extent can be made up front, in a
+  background thread if need be, so choosing a random shuffle is a dict lookup
+  '''
+  def __init__(self, max_extents = 64, max_rows = 200000):
+    self._max_extents = max_extents
+    self._max_rows = max_rows
+    self._rows = 0
+    self._entries = OrderedDict()
+    # The rotations made by a finished precompute of each (file, extent, cover)
+    self._samples = {}
+    self._lock = Lock()
+    self._pool = ThreadPoolExecutor(1, thread_name_prefix = 'extent-cache')
+    self.hits = 0
+    self.misses = 0
+
+  def from_config(config):
+    return ExtentCache(config.getint('EXTENTS', 'max_extents', 64), config.getint('EXTENTS', 'max_rows', 200000))
+
+  def rotations(method, extent_id):
+    ''' Every rotation vector of an extent, just None for one that isn't mutable '''
+    if not method.extent_mutable(extent_id):
+      return [None]
+    return list(itertools.product(*[range(len(s)) for s in Extent.sections(method, extent_id)]))
+
+  def random_rotation(method, extent_id, exclude = ()):
+    ''' A random rotation vector, not one of those in exclude unless there is nothing else '''
+    if not method.extent_mutable(extent_id):
+      return None
+    sections = Extent.sections(method, extent_id)
+    rotation = tuple(randrange(len(s)) for s in sections)
+    if rotation in exclude:
+      others = [r for r in ExtentCache.rotations(method, extent_id) if r not in exclude]
+      if others:
+        rotation = choice(others)
+    return rotation
+
+  def extent(self, method, extent_id, cover, rotations = None, exclude = ()):
+    ''' The precomputed Extent and the TruthReport for it, a random shuffle if mutable and no rotations are given
+
+    Once the shuffles have been precomputed the random one is picked from those made, so
+    it is a lookup even when there were more shuffles than the cache could keep. Until
+    then any shuffle can be picked. Rotations in exclude (ones already tried) are avoided
+    '''
+    with self._lock:
+      if rotations is None and method.extent_mutable(extent_id):
+        made = [r for r in self._samples.get((method.file, extent_id, cover), ()) if r not in exclude]
+        rotations = choice(made) if made else ExtentCache.random_rotation(method, extent_id, exclude)
+      key = (method.file, extent_id, cover, None if rotations is None else tuple(rotations))
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+      self.misses += 1
+
+    # Made outside the lock so the background thread doesn't hold up a lookup
+    extent = Extent(method, extent_id, cover = cover, rotations = rotations).precompute()
+    entry = (extent, Truth.prove(extent))
+    with self._lock:
+      old = self._entries.get(key)
+      if old is not None:
+        self._rows -= len(old[0])
+      self._entries[key] = entry
+      self._entries.move_to_end(key)
+      self._rows += len(extent)
+      # The one just added is always kept, even if it is bigger than max_rows on its own
+      while len(self._entries) > 1 and (len(self._entries) > self._max_extents or self._rows > self._max_rows):
+        dropped = self._entries.popitem(last = False)[1]
+        self._rows -= len(dropped[0])
+    return entry
+
+  def precompute(self, method, extent_id, cover):
+    ''' Make every rotation of the extent, unless there are more of them than the cache would keep '''
+    rotations = ExtentCache.rotations(method, extent_id)
+    # Every rotation is the same length so how many will fit is known before any are made
+    room = max(1, min(self._max_extents, self._max_rows // len(Extent(method, extent_id, cover = cover))))
+    if len(rotations) > room:
+      rotations = sample(rotations, room)
+    for rotation in rotations:
+      self.extent(method, extent_id, cover, rotation)
+    # Only picked from once they have all been made
+    if method.extent_mutable(extent_id):
+      with self._lock:
+        self._samples[(method.file, extent_id, cover)] = [tuple(r) for r in rotations]
+
+  def precompute_async(self, method, extent_id, cover):
+    ''' Same as precompute but in the background, for when a method has just been chosen '''
+    return self._pool.submit(self.precompute, method, extent_id, cover)
+
+  def __len__(self):
+    return len(self._entries)
+
+  def rows(self):
+    ''' Rows held between all the extents kept '''
+    return self._rows
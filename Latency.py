@@ -0,0 +1,77 @@
+from collections import deque
+
+class LatencyEstimator():
+  ''' Keeps a smoothed estimate of the round trip to the server from the echoes of Ron's own strikes
+
+  The smoothing is the same as TCP uses for its retransmit timer, a running average of the
+  round trip and of how much it varies. Strikes are sent early by half the round trip, the
+  one way latency, but the amount is never more than max_lead and moves by at most
+  max_step each time so jitter on the link doesn't make Ron's striking wander about
+  '''
+  ALPHA = 1 / 8
+  BETA = 1 / 4
+
+  # Echoes that haven't come back after this long are given up on
+  TIMEOUT = 2.0
+
+  def __init__(self, enabled = True, max_lead = 0.25, max_step = 0.005):
+    self.enabled = enabled
+    self.max_lead = max_lead
+    self.max_step = max_step
+    self._pending = {}
+    self.srtt = None
+    self.rttvar = 0.0
+    self.min_rtt = None
+    self.last_rtt = None
+    self.samples = 0
+    self.lost = 0
+    self._lead = 0.0
+
+  def reset(self):
+    ''' Start of a touch, anything still waiting for an echo is stale '''
+    self._pending = {}
+
+  def sent(self, bell, at):
+    self._pending.setdefault(bell, deque()).append(at)
+
+  def echo(self, bell, at):
+    ''' The server has told everyone the bell was rung '''
+    pending = self._pending.get(bell)
+    if not pending:
+      return
+    # Throw away any sends that have been waiting too long to be this one's echo
+    while pending and at - pending[0] > LatencyEstimator.TIMEOUT:
+      pending.popleft()
+      self.lost += 1
+    if not pending:
+      return
+    self._sample(at - pending.popleft())
+
+  def _sample(self, rtt):
+    self.samples += 1
+    self.last_rtt = rtt
+    self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+    if self.srtt is None:
+      self.srtt = rtt
+      self.rttvar = rtt / 2
+    else:
+      self.rttvar = (1 - LatencyEstimator.BETA) * self.rttvar + LatencyEstimator.BETA * abs(self.srtt - rtt)
+      self.srtt = (1 - LatencyEstimator.ALPHA) * self.srtt + LatencyEstimator.ALPHA * rtt
+
+    if self.enabled:
+      target = min(max(self.srtt / 2, 0.0), self.max_lead)
+      step = max(-self.max_step, min(self.max_step, target - self._lead))
+      self._lead += step
+
+  def lead(self):
+    ''' How early strikes are being sent '''
+    return self._lead
+
+  def stats(self):
+    return {'samples': self.samples,
+            'lost': self.lost,
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'min_rtt': self.min_rtt,
+            'last_rtt': self.last_rtt,
+            'lead': self._lead}
@@ -0,0 +1,132 @@
+''' Rings in lots of towers at once on a local StandInServer to find how far Ron scales
+
+  python LoadTest.py "data/Plain Bob Doubles.mcf" 1 --towers 50 --engine async --pace 2.0
+
+The server runs in its own process so only Ron's costs are measured here. The scripted
+towers call 'Look to' as soon as Ron has set the bells and optionally 'Stand next' after
+stand seconds. Timing error is when each strike was sent against when it was scheduled,
+taken from the towers' strike logs.
+'''
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+from Methods import Method
+from TowerInfo import TowerInfo
+from ExtentCache import ExtentCache
+from async_tower import AsyncTower, ring_towers
+from tower import Tower
+import StandInServer
+
+def wait_for_server(host, port, seconds = 10.0):
+  deadline = time.monotonic() + seconds
+  while True:
+    try:
+      socket.create_connection((host, port), 1.0).close()
+      return
+    except OSError:
+      if time.monotonic() > deadline:
+        raise
+      time.sleep(0.05)
+
+def percentile(values, fraction):
+  ''' values must be sorted '''
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, int(fraction * (len(values) - 1) + 0.5))]
+
+async def _ring_async(infos, method, extent_id, cover, pace, extents):
+  towers = [AsyncTower(info, None, extents) for info in infos]
+  for tower in towers:
+    tower.log_strikes()
+    tower.set_pace(pace)
+    tower.add_method_extent(method, extent_id, cover)
+  await ring_towers(towers)
+  await asyncio.gather(*[tower.close() for tower in towers])
+  return [tower.strike_log for tower in towers]
+
+def ring_async(infos, method, extent_id, cover, pace, extents):
+  ''' Every tower is a coroutine on one event loop in this thread '''
+  return asyncio.run(_ring_async(infos, method, extent_id, cover, pace, extents))
+
+def ring_threaded(infos, method, extent_id, cover, pace, extents):
+  ''' The GUI's Tower, driven from this thread with the ringing on the shared background loop '''
+  towers = [Tower(info, None, extents) for info in infos]
+  for tower in towers:
+    tower.log_strikes()
+    tower.set_pace(pace)
+    tower.add_method_extent(method, extent_id, cover)
+    tower.wait_for_look_to()
+  for tower in towers:
+    tower.join()
+  for tower in towers:
+    tower.close()
+  return [tower.strike_log() for tower in towers]
+
+ENGINES = {'async': ring_async, 'threaded': ring_threaded}
+
+def load_test(file, extent_id, towers, engine = 'async', pace = 2.0, cover = False, host = '127.0.0.1', port = 8765,
+              look_to = 0.5, stand = None):
+  ''' Ring towers touches at once against a StandInServer started for the purpose, returns the figures as a dict '''
+  server = multiprocessing.Process(target = StandInServer.serve, args = (host, port, look_to, stand), daemon = True)
+  server.start()
+  try:
+    wait_for_server(host, port)
+    method = Method(file)
+    cover = cover and method.coverable()
+    extents = ExtentCache()
+    # Generate the extent before the clock starts
+    extents.extent(method, extent_id, cover)
+    infos = [TowerInfo(100000000 + ndx, 'Load test {}'.format(ndx), 'http://{}:{}'.format(host, port)) for ndx in range(towers)]
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    logs = ENGINES[engine](infos, method, extent_id, cover, pace, extents)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+  finally:
+    server.terminate()
+    server.join()
+
+  errors = sorted(e.at - e.scheduled for log in logs if log for e in log.strikes())
+  cpu = (after.ru_utime + after.ru_stime) - (usage.ru_utime + usage.ru_stime)
+  return {'engine': engine,
+          'towers': towers,
+          'strikes': len(errors),
+          'seconds': elapsed,
+          'strikes_per_second': len(errors) / elapsed if elapsed else 0.0,
+          'error_ms': {'p50': percentile(errors, 0.5) * 1000,
+                       'p90': percentile(errors, 0.9) * 1000,
+                       'p99': percentile(errors, 0.99) * 1000,
+                       'max': errors[-1] * 1000 if errors else 0.0},
+          'cpu_seconds_per_tower': cpu / towers,
+          # ru_maxrss is in kilobytes on Linux
+          'peak_rss_mb': after.ru_maxrss / 1024,
+          'rss_growth_mb_per_tower': (after.ru_maxrss - usage.ru_maxrss) / 1024 / towers}
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Load test Ron against a local stand in server')
+  parser.add_argument('file', help = 'method .mcf file')
+  parser.add_argument('extent', type = int, help = 'extent number')
+  parser.add_argument('--towers', type = int, default = 10)
+  parser.add_argument('--engine', choices = sorted(ENGINES), default = 'async')
+  parser.add_argument('--pace', type = float, default = 2.0)
+  parser.add_argument('--cover', action = 'store_true')
+  parser.add_argument('--port', type = int, default = 8765)
+  parser.add_argument('--stand', type = float, default = None, help = "call 'Stand next' this many seconds after 'Look to'")
+  parser.add_argument('--json', action = 'store_true', help = 'print the results as JSON')
+  args = parser.parse_args()
+
+  results = load_test(args.file, 'EXTENT-' + str(args.extent), args.towers, args.engine, args.pace, args.cover,
+                      port = args.port, stand = args.stand)
+  if args.json:
+    print(json.dumps(results, indent = 2))
+  else:
+    print('{engine}: {towers} towers, {strikes} strikes in {seconds:.1f}s, {strikes_per_second:.1f} strikes/s'.format(**results))
+    print('timing error ms: p50 {p50:.2f}, p90 {p90:.2f}, p99 {p99:.2f}, max {max:.2f}'.format(**results['error_ms']))
+    print('per tower: {:.3f} CPU seconds, {:.2f}MB RSS (peak {:.1f}MB)'.format(
+      results['cpu_seconds_per_tower'], results['rss_growth_mb_per_tower'], results['peak_rss_mb']))
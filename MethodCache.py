@@ -0,0 +1,56 @@
+import os
+import pickle
+
+from Methods import Method
+
+class MethodCache():
+  ''' Parsed methods kept on disk so a warm start doesn't have to run configparser over every .mcf file
+
+  The whole cache is one pickle read in a single go, each method in it is stored as
+  its own pickled blob along with the mtime and size of the file it came from so it is
+  only unpickled when asked for and is parsed again if the file has changed
+  '''
+
+  # Bump this whenever Method changes shape so old caches are thrown away
+  # 1 plain attributes, 2 place notation and compiled lead tables, 3 extent courses
+  VERSION = 3
+
+  def __init__(self, cache_file):
+    self._cache_file = cache_file
+    self._entries = {}
+    self._dirty = False
+    self.hits = 0
+    self.misses = 0
+
+    try:
+      with open(cache_file, 'rb') as f:
+        cache = pickle.load(f)
+      if cache.get('version') == MethodCache.VERSION:
+        self._entries = cache['methods']
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError):
+      # Missing or unreadable cache, it will be rebuilt
+      self._entries = {}
+
+  def method(self, file):
+    stat = os.stat(file)
+    key = os.path.abspath(file)
+    entry = self._entries.get(key)
+    if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+      self.hits += 1
+      return pickle.loads(entry[2])
+
+    self.misses += 1
+    method = Method(file)
+    self._entries[key] = (stat.st_mtime_ns, stat.st_size, pickle.dumps(method, pickle.HIGHEST_PROTOCOL))
+    self._dirty = True
+    return method
+
+  def save(self):
+    if not self._dirty:
+      return
+    # Write to a temporary file and swap it in so a crash never leaves half a cache
+    tmp = self._cache_file + '.tmp'
+    with open(tmp, 'wb') as f:
+      pickle.dump({'version': MethodCache.VERSION, 'methods': self._entries}, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, self._cache_file)
+    self._dirty = False
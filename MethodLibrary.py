@@ -0,0 +1,145 @@
+import os
+import glob
+from collections import OrderedDict
+
+from Methods import Method
+from MethodCache import MethodCache
+
+class MethodInfo():
+  ''' What the library index knows about a method without loading it '''
+  def __init__(self, file, name, bells, coverable, extents):
+    self.file = file
+    self.name = name
+    self.bells = bells
+    self._coverable = coverable
+    # Extent key to name, in the order they appear in the file
+    self._extents = extents
+
+  def __str__(self):
+    return self.name
+
+  def get_name(self):
+    return self.name
+
+  def number_of_bells(self):
+    return self.bells
+
+  def coverable(self):
+    return self._coverable
+
+  def extent_exists(self, extent_id):
+    return ('EXTENT-' + str(extent_id)) in self._extents
+
+  def extent_name(self, key):
+    return self._extents[key]
+
+  def extent_keys(self):
+    return list(self._extents)
+
+  def scan(file):
+    ''' Read just the [INFO] section and extent names from a .mcf file '''
+    info = {}
+    extents = {}
+    section = None
+    with open(file) as f:
+      for line in f:
+        line = line.strip()
+        if not line or line[0] in '#;':
+          continue
+        if line[0] == '[':
+          section = line[1:line.index(']')]
+          if section.startswith('EXTENT-'):
+            extents[section] = ''
+          continue
+        if section != 'INFO' and not (section and section.startswith('EXTENT-')):
+          continue
+        # Same key/value delimiters as configparser
+        delimiters = [n for n in (line.find('='), line.find(':')) if n >= 0]
+        if not delimiters:
+          continue
+        ndx = min(delimiters)
+        key = line[:ndx].strip()
+        value = line[ndx + 1:].strip()
+        if section == 'INFO':
+          info[key.lower()] = value
+        elif key.upper() == 'NAME':
+          extents[section] = value
+
+    coverable = info.get('coverable', 'no').lower() in ('1', 'yes', 'true', 'on')
+    return MethodInfo(file, info['name'], int(info['bells']), coverable, extents)
+
+class MethodLibrary():
+  ''' Searchable index of every method with the full definitions loaded on first use
+
+  Only a bounded number of full Methods are kept in memory, the least recently used
+  is dropped when another one is loaded
+  '''
+  def __init__(self, files, cache = None, max_loaded = 16):
+    self._cache = cache
+    self._max_loaded = max_loaded
+    self._loaded = OrderedDict()
+    self._index = []
+    self._by_name = {}
+    self._by_stage = {}
+    for file in files:
+      info = MethodInfo.scan(file)
+      self._index.append(info)
+      self._by_name[info.name.lower()] = info
+      self._by_stage.setdefault(info.bells, []).append(info)
+
+  def from_directory(directory, cache = None, max_loaded = 16):
+    return MethodLibrary(sorted(glob.glob(os.path.join(directory, '*.mcf'))), cache, max_loaded)
+
+  def from_config(config):
+    ''' Every .mcf in the [LIBRARY] directory if one is given, otherwise the ones listed in [MCF] '''
+    cache = MethodCache(config.get('CACHE', 'methods', './data/methods.cache'))
+    max_loaded = config.getint('LIBRARY', 'max_loaded', 16)
+    directory = config.get('LIBRARY', 'directory', '')
+    if directory:
+      return MethodLibrary.from_directory(directory, cache, max_loaded)
+    return MethodLibrary(['./data/' + mcf[1] + '.mcf' for mcf in config.items('MCF')], cache, max_loaded)
+
+  def __len__(self):
+    return len(self._index)
+
+  def methods(self):
+    return list(self._index)
+
+  def find(self, name):
+    return self._by_name.get(name.lower())
+
+  def search(self, text = None, bells = None, coverable = None):
+    ''' Methods whose name contains the text, rung on the number of bells and coverable as asked '''
+    candidates = self._by_stage.get(bells, []) if bells is not None else self._index
+    if text:
+      text = text.lower()
+    return [info for info in candidates
+            if (not text or text in info.name.lower())
+            and (coverable is None or info.coverable() == coverable)]
+
+  def method(self, info):
+    ''' The full Method for an index entry or method name '''
+    if isinstance(info, str):
+      info = self.find(info)
+      if info is None:
+        raise KeyError('No such method')
+
+    method = self._loaded.get(info.file)
+    if method is not None:
+      self._loaded.move_to_end(info.file)
+      return method
+
+    if self._cache:
+      # Saved once when the library is closed rather than rewritten on every miss
+      method = self._cache.method(info.file)
+    else:
+      method = Method(info.file)
+    self._loaded[info.file] = method
+    while len(self._loaded) > self._max_loaded:
+      self._loaded.popitem(last = False)
+    return method
+
+  def close(self):
+    ''' Write out the method cache if any methods have been parsed since it was read '''
+    if self._cache:
+      self._cache.save()
@@ -1,214 +1,469 @@
 from time import sleep
 import configparser
+from array import array
+from operator import itemgetter
 from random import randrange
 
+import PlaceNotation
+
+CALL_GO = 0x01
+CALL_THATS_ALL = 0x02
+CALL_BOB = 0x04
+CALL_SINGLE = 0x08
+CALL_STAND = 0x10
+
+class RowStore():
+  ''' A block of rows held as one contiguous array of bytes, one byte per bell, plus a byte of call flags per row '''
+  def __init__(self, number_of_rows, number_of_bells):
+    self.number_of_rows = number_of_rows
+    self.number_of_bells = number_of_bells
+    # Allocated up front and never resized so memoryviews of it are always safe to hand out
+    self.positions = array('B', bytes(number_of_rows * number_of_bells))
+    self.calls = array('B', bytes(number_of_rows))
+    self._view = memoryview(self.positions)
+  
+  def __len__(self):
+    return self.number_of_rows
+  
+  def __getitem__(self, ndx):
+    if ndx < 0:
+      ndx += self.number_of_rows
+    if ndx < 0 or ndx >= self.number_of_rows:
+      raise IndexError('row index out of range')
+    return Row(self, ndx)
+  
+  def __iter__(self):
+    for ndx in range(self.number_of_rows):
+      yield Row(self, ndx)
+  
+  def row_positions(self, ndx):
+    return self._view[ndx * self.number_of_bells:(ndx + 1) * self.number_of_bells]
+  
+  def block(self, start, stop):
+    ''' Zero copy view of the positions of rows start to stop, row after row '''
+    return self._view[start * self.number_of_bells:stop * self.number_of_bells]
+  
+  def set_round(self, ndx):
+    self._view[ndx * self.number_of_bells:(ndx + 1) * self.number_of_bells] = bytes(range(1, self.number_of_bells + 1))
+  
+  def nbytes(self):
+    return self.positions.itemsize * len(self.positions) + self.calls.itemsize * len(self.calls)
+
+def _call_flag(flag):
+  def get(row):
+    return bool(row.store.calls[row.index] & flag)
+  def set(row, value):
+    if value:
+      row.store.calls[row.index] |= flag
+    else:
+      row.store.calls[row.index] &= ~flag
+  return property(get, set)
+
 class Row():
-  def __init__(self, number_of_bells):
-    self.positions = [None for ndx in range(number_of_bells)]
-    self.call_go = False
-    self.call_thats_all = False
-    self.call_bob = False
-    self.call_single = False
-    self.call_stand = False
+  ''' Light view of one row in a RowStore '''
+  __slots__ = ('store', 'index')
+  
+  def __init__(self, store, index):
+    self.store = store
+    self.index = index
+  
+  @property
+  def positions(self):
+    return self.store.row_positions(self.index)
+  
+  call_go = _call_flag(CALL_GO)
+  call_thats_all = _call_flag(CALL_THATS_ALL)
+  call_bob = _call_flag(CALL_BOB)
+  call_single = _call_flag(CALL_SINGLE)
+  call_stand = _call_flag(CALL_STAND)
+  
+class LeadTable():
+  ''' A lead compiled into permutations of the lead head, one per row, so the whole lead is made in one go '''
+  def __init__(self, perms, call_row):
+    self.length = len(perms)
+    self.call_row = call_row
+    self.perms = perms
+    # All the rows of the lead flattened into one list of indexes into the lead head
+    flat = [ndx for perm in perms for ndx in perm]
+    if len(flat) > 1:
+      self._gather = itemgetter(*flat)
+    elif flat:
+      single = itemgetter(flat[0])
+      self._gather = lambda row: (single(row), )
+    else:
+      self._gather = lambda row: ()
+  
+  def gather(self, lead_head):
+    ''' Positions of every row of the lead, one row after another '''
+    return self._gather(lead_head)
+  
+  def with_cover(self, bells):
+    ''' The same lead with the cover bell left behind '''
+    return LeadTable([perm + [bells] for perm in self.perms], self.call_row)
   
+  def from_tracks(bells, sections):
+    ''' Compile track work, each bell in track n of the previous row goes to the listed positions '''
+    perms = []
+    base = list(range(bells))
+    for work in sections:
+      rows = Extent._work_rows(work)
+      section = [[None] * bells for ndx in range(rows)]
+      if rows:
+        for track in range(bells):
+          for ndx, t in enumerate(work[track]):
+            section[ndx][t - 1] = base[track]
+      for perm in section:
+        if None in perm:
+          raise ValueError('Tracks do not make a row')
+        perms.append(perm)
+      if section:
+        base = section[-1]
+    return perms
+
 class Extent():
+  ENGINE_TRACKS = 'tracks'
+  ENGINE_PLACE_NOTATION = 'place notation'
+  
   LEAD_TYPE_PLAIN = 'P'
   LEAD_TYPE_BOB = 'B'
   LEAD_TYPE_SINGLE = 'S'
   
-  def __init__(self, method, extent_id, cover = True, intro_courses = 1, extent_courses = 1):
+  def __init__(self, method, extent_id, cover = True, intro_courses = 1, extent_courses = None, engine = None, rotations = None):
     self.name = method.extent_name(extent_id)
+    self.extent_id = extent_id
+    # A multi part composition gives the calling of one part and how many times it is rung
+    if extent_courses is None:
+      extent_courses = method.extent_courses(extent_id)
     self.length = method.extent_length(extent_id) * extent_courses
     self.definition = method.extent_definition(extent_id)
     # If the extent is mutable it can be shift shuffled
     # The sections that can be shifted are delimited by '-' characters so will be split, shifted and then stuck togather
+    # The number of shifts for each section can be given, otherwise they are picked at random
+    self.rotations = None
     if method.extent_mutable(extent_id):
-        # Remove all formatting spaces
-        self.definition = self.definition.replace(' ', '')
-        # Break into sections
-        sections = self.definition.split('-')
-        for ndx in range(len(sections)):
-            s = sections[ndx]
-            # Decide how many shifts to perform on the section
-            shifts = randrange(len(s))
-            for shift in range(shifts):
-                s = s[-1] + s[0:-1]
-            sections[ndx] = s
-        # Reassemble the sections
-        self.definition = ''.join(sections)
+        sections = Extent.sections(method, extent_id)
+        if rotations is None:
+            rotations = [randrange(len(s)) for s in sections]
+        self.rotations = tuple(rotations)
+        # Reassemble the sections, each one rotated right by its number of shifts
+        self.definition = ''.join(Extent.rotate(s, shifts) for s, shifts in zip(sections, self.rotations))
     # The number of bells being rung is the number of bells in the method plus the optional cover
     self.number_of_bells = method.number_of_bells()
     self.cover = cover
     if self.cover:
       self.number_of_bells += 1
     
-    # A reference to the parent method is only needed for dumping to text
+    # A reference to the parent method is needed to generate the rows and for dumping to text
     self.method = method
+    self.intro_courses = intro_courses
+    self.extent_courses = extent_courses
+    # Place notation is used when the method has it unless asked otherwise
+    if engine is None:
+      engine = method.default_engine(self.definition)
+    self.engine = engine
     
-    self.rows = []
+    # The rows are generated lead by lead as they are walked, all that is worked out up front is
+    # how many there will be so the calls at the end of the touch can be placed. An extent
+    # that is going to be rung more than once can be precomputed into a single store instead,
+    # which is what a tower rings: the ExtentCache hands it precomputed and proved extents so
+    # on the ringing path the whole touch is in memory (a byte a bell a row) before Look to
+    self._store = None
+    self.intro_length = intro_courses * 2
+    self.body_length = min(self.length, self._lead_rows())
+    self.size = self.intro_length + self.body_length
+    # If the extent ends on a back stroke the extra half round is added
+    if self.size % 2 != 0:
+      self.size += 1
+    # Followed by the final rounds
+    self.size += 2
+  
+  def __len__(self):
+    return self.size
+  
+  def sections(method, extent_id):
+    ''' The sections of a mutable extent that can be shifted '''
+    # Remove all formatting spaces and break into sections
+    return method.extent_definition(extent_id).replace(' ', '').split('-')
+  
+  def rotate(section, shifts):
+    ''' The section with its last shifts leads moved to the front '''
+    split = len(section) - shifts % len(section) if section else 0
+    return section[split:] + section[:split]
+  
+  def __iter__(self):
+    return self.rows()
+  
+  def rows(self):
+    ''' Generator for every row of the touch including the intro and final rounds
 
-    # The last lead is 'plain' to force a plain start in the first lead
-    last_lead = Extent.LEAD_TYPE_PLAIN
-    for courses in range(extent_courses):
-      # Build the course
+    Lazy, a lead at a time, unless the extent has been precomputed
+    '''
+    if self._store is not None:
+      # The calls are already in the precomputed store
+      yield from self._store
+      return
+    
+    # That's All goes on the second to last row of the extent and Stand on the second to last row
+    thats_all = self.intro_length + self.body_length - 2
+    stand = self.size - 2
+    
+    ndx = 0
+    for row in self._rows():
+      if ndx == self.intro_length - 1:
+        row.call_go = True
+      if ndx == thats_all:
+        row.call_thats_all = True
+      if ndx == stand:
+        row.call_stand = True
+      yield row
+      ndx += 1
+  
+  def _rows(self):
+    intro = RowStore(self.intro_length, self.number_of_bells)
+    for ndx in range(self.intro_length):
+      intro.set_round(ndx)
+    yield from intro
+    
+    yield from self._body()
+    
+    extro = RowStore(self.size - self.intro_length - self.body_length, self.number_of_bells)
+    for ndx in range(len(extro)):
+      extro.set_round(ndx)
+    yield from extro
+  
+  def compact(self):
+    ''' Every row of the touch in a single RowStore '''
+    if self._store is not None:
+      return self._store
+    store = RowStore(self.size, self.number_of_bells)
+    ndx = 0
+    for row in self.rows():
+      store.row_positions(ndx)[:] = row.positions
+      store.calls[ndx] = row.store.calls[row.index]
+      ndx += 1
+    return store
+  
+  def precompute(self):
+    ''' Generate every row now so ringing and proving the extent are only a walk over the store '''
+    self._store = self.compact()
+    return self
+  
+  def precomputed(self):
+    return self._store is not None
+  
+  def _leads(self):
+    for courses in range(self.extent_courses):
       for lead in self.definition:
-        Extent._add_lead_start(last_lead, self.rows, method, self.length, cover)
         if lead in ('p', 'P'):
-          Extent._add_plain(self.rows, method, self.length, cover)
-          last_lead = Extent.LEAD_TYPE_PLAIN
+          yield Extent.LEAD_TYPE_PLAIN
         elif lead in ('b', 'B'):
-          Extent._add_bob(self.rows, method, self.length, cover)
-          last_lead = Extent.LEAD_TYPE_BOB
+          yield Extent.LEAD_TYPE_BOB
         elif lead in ('s', 'S'):
-          Extent._add_single(self.rows, method, self.length, cover)
-          last_lead = Extent.LEAD_TYPE_SINGLE
-    
-    # Add the intro rounds and the Go Method call to the last backstroke of the intro
-    intro = []
-    for ndx in range(intro_courses):
-      Extent._add_round(intro, self.number_of_bells)
-    intro[((intro_courses - 1) * 2) + 1].call_go = True
-    self.rows = intro + self.rows
-    
-    # Add That's All to the second to last row of the extent
-    self.rows[len(self.rows) - 2].call_thats_all = True
-        
-    # If the extent ended on a back stroke add the extra half round
-    if len(self.rows) % 2 != 0:
-      Extent._add_half_round(self.rows, self.number_of_bells)
-    
-    # Add the final rounds and the call to Stand
-    Extent._add_round(self.rows, self.number_of_bells)
-    self.rows[len(self.rows) - 2].call_stand = True
-    
-  def _add_half_round(rows, bells):
-    row = Row(bells)
-    for ndx in range(bells):
-      row.positions[ndx] = ndx + 1
-    rows.append(row)
-
-  def _add_round(rows, bells):
-    Extent._add_half_round(rows, bells)
-    Extent._add_half_round(rows, bells)
-
-  def _add_lead_start(last_lead, rows, method, length, cover):
-    if last_lead == Extent.LEAD_TYPE_PLAIN:
-      Extent._apply(rows, method.number_of_bells(), method.plain_start, length, cover)
-    elif last_lead == Extent.LEAD_TYPE_BOB:
-      Extent._apply(rows, method.number_of_bells(), method.bob_start, length, cover)
-    elif last_lead == Extent.LEAD_TYPE_SINGLE:
-      Extent._apply(rows, method.number_of_bells(), method.single_start, length, cover)
-
-  def _add_plain(rows, method, length, cover):
-    Extent._apply(rows, method.number_of_bells(), method.tracks, length, cover)
-    Extent._apply(rows, method.number_of_bells(), method.plain, length, cover)
-
-  def _add_bob(rows, method, length, cover):
-    Extent._apply(rows, method.number_of_bells(), method.tracks, length, cover)
-    # Call the Bob at the beginning of the last row BEFORE the Bob
-    rows[len(rows) - 1].call_bob = True
-    Extent._apply(rows, method.number_of_bells(), method.bob, length, cover)
-
-  def _add_single(rows, method, length, cover):
-    Extent._apply(rows, method.number_of_bells(), method.tracks, length, cover)
-    # Call the Single at the beginning of the last row BEFORE the Single
-    rows[len(rows) - 1].call_single = True
-    Extent._apply(rows, method.number_of_bells(), method.single, length, cover)
-
-  def _apply(rows, number_of_bells, work, length, cover):
-    prev = len(rows) - 1
-    bells = number_of_bells
-    if cover:
-      bells += 1
+          yield Extent.LEAD_TYPE_SINGLE
+  
+  def _lead_rows(self):
+    ''' Number of rows in all the leads without generating them '''
+    total = 0
+    # The last lead is 'plain' to force a plain start in the first lead
+    last_lead = Extent.LEAD_TYPE_PLAIN
+    for lead in self._leads():
+      total += self._lead_length(last_lead, lead)
+      last_lead = lead
+    return total
+  
+  def _lead_length(self, last_lead, lead):
+    return self.method.lead_table(last_lead, lead, self.cover, self.engine).length
+  
+  def _body(self):
+    # Start from rounds
+    prev = bytes(range(1, self.number_of_bells + 1))
     
+    remaining = self.body_length
+    last_lead = Extent.LEAD_TYPE_PLAIN
+    for lead in self._leads():
+      if remaining <= 0:
+        break
+      
+      # Each lead is built in its own small store and handed out before the next is made
+      table = self.method.lead_table(last_lead, lead, self.cover, self.engine)
+      rows = RowStore(table.length, self.number_of_bells)
+      rows.positions[:] = array('B', table.gather(prev))
+      # Call the Bob or Single at the beginning of the last row BEFORE it
+      if table.call_row is not None:
+        if lead == Extent.LEAD_TYPE_BOB:
+          rows[table.call_row].call_bob = True
+        elif lead == Extent.LEAD_TYPE_SINGLE:
+          rows[table.call_row].call_single = True
+      last_lead = lead
+      
+      if table.length:
+        prev = bytes(rows.row_positions(table.length - 1))
+      for row_ndx in range(min(table.length, remaining)):
+        yield rows[row_ndx]
+      remaining -= table.length
+    
+  def _work_rows(work):
     if len(work) > 0:
-      for ndx in range(len(work[0])):
-          if length > len(rows):
-              row = Row(bells)
-              if cover:
-                row.positions[bells -1] = bells
-              rows.append(row)
-
-      for track in range(number_of_bells):
-          if prev < 0:
-              bell = track + 1
-          else:
-              bell = rows[prev].positions[track]
-          curr = prev + 1
-          for t in work[track]:
-              if curr < length:
-                  rows[curr].positions[t - 1] = bell
-                  curr += 1
+      return len(work[0])
+    return 0
+
 class Method():
   def __init__(self, file):
-    self.definition = configparser.ConfigParser()
-    self.definition.optionxform = str # Don't want keys to be lower cased
+    definition = configparser.ConfigParser()
+    definition.optionxform = str # Don't want keys to be lower cased
     
-    self.definition.read(file)
-    self.name = self.definition.get('INFO', 'name')
+    definition.read(file)
+    self.file = file
+    
+    # Everything needed is taken out of the definition and kept as plain attributes
+    # so that the accessors are cheap and a Method can be pickled into the method cache
+    self.name = definition.get('INFO', 'name')
+    self._bells = definition.getint('INFO', 'bells')
+    self._coverable = definition.getboolean('INFO', 'coverable', fallback = False)
 
-    self.tracks = {}
-    for key in self.definition['TRACKS']:
-      self.tracks[int(key) - 1] = [int(v) for v in self.definition['TRACKS'][key].split()]
+    self.tracks = Method._work(definition, 'TRACKS')
 
     # Just in case a method is added where the Bobs and singles have an
     # effect across the end of a lead and into the start of the next lead. To account for
     # this the concept of the start of a lead being different depending on the previous
     # lead was introduced. The PLAIN_START, BOB_START and SINGLE_START sections of the
     # definition files are optional as they are not necessary for most mothods
-    self.plain_start = {}
-    if self.definition.has_section('PLAIN_START'):
-      for key in self.definition['PLAIN_START']:
-        self.plain_start[int(key) - 1] = [int(v) for v in self.definition['PLAIN_START'][key].split()]
-      
-    self.plain = {}
-    if self.definition.has_section('PLAIN'):
-      for key in self.definition['PLAIN']:
-        self.plain[int(key) - 1] = [int(v) for v in self.definition['PLAIN'][key].split()]
-
-    self.bob_start = {}
-    if self.definition.has_section('BOB_START'):
-      for key in self.definition['BOB_START']:
-        self.bob_start[int(key) - 1] = [int(v) for v in self.definition['BOB_START'][key].split()]
-      
-    self.bob = {}
-    if self.definition.has_section('BOB'):
-      for key in self.definition['BOB']:
-        self.bob[int(key) - 1] = [int(v) for v in self.definition['BOB'][key].split()]
-
-    self.single_start = {}
-    if self.definition.has_section('SINGLE_START'):
-      for key in self.definition['SINGLE_START']:
-        self.single_start[int(key) - 1] = [int(v) for v in self.definition['SINGLE_START'][key].split()]
-      
-    self.single = {}
-    if self.definition.has_section('SINGLE'):
-      for key in self.definition['SINGLE']:
-        self.single[int(key) - 1] = [int(v) for v in self.definition['SINGLE'][key].split()]
+    self.plain_start = Method._work(definition, 'PLAIN_START')
+    self.plain = Method._work(definition, 'PLAIN')
+    self.bob_start = Method._work(definition, 'BOB_START')
+    self.bob = Method._work(definition, 'BOB')
+    self.single_start = Method._work(definition, 'SINGLE_START')
+    self.single = Method._work(definition, 'SINGLE')
+    
+    # Optional place notation for the same method, the bob and single (and their starts)
+    # replace the changes at the end (or start) of the lead. When present this is what
+    # the rows are generated from
+    self.place_notation = {}
+    if definition.has_section('PLACE_NOTATION'):
+      for key in definition['PLACE_NOTATION']:
+        self.place_notation[key.upper()] = PlaceNotation.parse(definition['PLACE_NOTATION'][key], self._bells)
+    
+    # Compiled lead tables are made when first needed
+    self._tables = {}
+    
+    self._extents = {}
+    for key in definition.sections():
+      if key.startswith('EXTENT-'):
+        self._extents[key] = (definition.get(key, 'NAME'),
+                              definition.getint(key, 'LENGTH'),
+                              definition.get(key, 'DEFINITION'),
+                              definition.getboolean(key, 'MUTABLE', fallback = False),
+                              definition.getint(key, 'COURSES', fallback = 1))
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    # The compiled tables hold itemgetters which can't be pickled, they are cheap to remake
+    state['_tables'] = {}
+    return state
+
+  def _work(definition, section):
+    work = {}
+    if definition.has_section(section):
+      for key in definition[section]:
+        work[int(key) - 1] = [int(v) for v in definition[section][key].split()]
+    return work
 
   def __str__(self):
       return self.name
   
+  def lead_start(self, last_lead):
+    ''' The work at the start of a lead depends on how the previous lead ended '''
+    if last_lead == Extent.LEAD_TYPE_BOB:
+      return self.bob_start
+    elif last_lead == Extent.LEAD_TYPE_SINGLE:
+      return self.single_start
+    return self.plain_start
+  
+  def lead_end(self, lead):
+    if lead == Extent.LEAD_TYPE_BOB:
+      return self.bob
+    elif lead == Extent.LEAD_TYPE_SINGLE:
+      return self.single
+    return self.plain
+  
+  def default_engine(self, calling):
+    ''' Place notation if the method has it and it has every call in the calling
+
+    A call the notation doesn't have is rung as a plain lead, where the tracks ring
+    whatever their [BOB] or [SINGLE] makes of it (a short lead if there is none), so
+    such a calling is left on the tracks and rings the same rows it always has
+    '''
+    if not self.place_notation:
+      return Extent.ENGINE_TRACKS
+    calling = calling.upper()
+    for lead, key in ((Extent.LEAD_TYPE_BOB, 'BOB'), (Extent.LEAD_TYPE_SINGLE, 'SINGLE')):
+      if lead in calling and key not in self.place_notation:
+        return Extent.ENGINE_TRACKS
+    return Extent.ENGINE_PLACE_NOTATION
+
+  def lead_table(self, last_lead, lead, cover, engine):
+    ''' The compiled LeadTable for a lead of the given type following the last one '''
+    key = (last_lead, lead, cover, engine)
+    table = self._tables.get(key)
+    if table is None:
+      if engine == Extent.ENGINE_PLACE_NOTATION:
+        table = self._notation_table(last_lead, lead)
+      else:
+        table = self._track_table(last_lead, lead)
+      if cover:
+        table = table.with_cover(self._bells)
+      self._tables[key] = table
+    return table
+
+  def _track_table(self, last_lead, lead):
+    start = self.lead_start(last_lead)
+    perms = LeadTable.from_tracks(self._bells, [start, self.tracks, self.lead_end(lead)])
+    call_row = None
+    if lead != Extent.LEAD_TYPE_PLAIN:
+      calls_at = Extent._work_rows(start) + Extent._work_rows(self.tracks)
+      if calls_at:
+        call_row = calls_at - 1
+    return LeadTable(perms, call_row)
+
+  def _notation_table(self, last_lead, lead):
+    changes = list(self.place_notation['METHOD'])
+    end_key = {Extent.LEAD_TYPE_PLAIN: 'PLAIN', Extent.LEAD_TYPE_BOB: 'BOB', Extent.LEAD_TYPE_SINGLE: 'SINGLE'}[lead]
+    start_key = {Extent.LEAD_TYPE_PLAIN: 'PLAIN_START', Extent.LEAD_TYPE_BOB: 'BOB_START', Extent.LEAD_TYPE_SINGLE: 'SINGLE_START'}[last_lead]
+    
+    # A call the method doesn't have is rung as a plain lead
+    call_row = None
+    end = self.place_notation.get(end_key)
+    if end:
+      changes[len(changes) - len(end):] = end
+      if lead != Extent.LEAD_TYPE_PLAIN and len(changes) > len(end):
+        call_row = len(changes) - len(end) - 1
+    start = self.place_notation.get(start_key)
+    if start:
+      changes[:len(start)] = start
+    return LeadTable(PlaceNotation.lead_permutations(changes, self._bells), call_row)
+
   def get_name(self):
     return self.name
   
   def extent_exists(self, extent_id):
     key = 'EXTENT-' + str(extent_id)
-    return key in self.definition
+    return key in self._extents
     
   def number_of_bells(self):
-    return self.definition.getint('INFO', 'bells')
+    return self._bells
     
   def coverable(self):
-    return self.definition.getboolean('INFO', 'coverable', fallback = False)
+    return self._coverable
     
   def extent_name(self, key):
-    return self.definition.get(key, 'NAME')
+    return self._extents[key][0]
   
   def extent_length(self, key):
-    return self.definition.getint(key, 'LENGTH')
+    return self._extents[key][1]
 
-  def extent_size(self, key, cover, intros, courses):
+  def extent_size(self, key, cover, intros, courses = None):
+      if courses is None:
+        courses = self.extent_courses(key)
       bells = self.number_of_bells()
       if self.coverable() and cover:
           bells += 1
@@ -220,8 +475,11 @@ class Method():
       return size
   
   def extent_definition(self, key):
-    return self.definition.get(key, 'DEFINITION')
+    return self._extents[key][2]
 
   def extent_mutable(self, key):
-    return self.definition.getboolean(key, 'MUTABLE', fallback = False)
-    
+    return self._extents[key][3]
+
+  def extent_courses(self, key):
+    ''' How many times the calling is rung, more than one for a multi part composition '''
+    return self._extents[key][4]
@@ -0,0 +1,223 @@
+''' What each tower is up to while it rings, exported for Prometheus
+
+Timings are kept in fixed size ring buffers of doubles allocated up front, so recording
+one in the ringing loop is a store into an array. Quantiles are only worked out when the
+metrics are exported, as a Prometheus summary, along with counters of rows, calls,
+stand backs and connection events. The text can be written to a file now and then (for
+node_exporter's textfile collector) or served over HTTP, or both.
+'''
+import os
+import time
+import logging
+import cProfile
+import threading
+from array import array
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger('RingingRon')
+
+class RingBuffer():
+  ''' The last size values, with a running count and sum of every value ever added '''
+  def __init__(self, size):
+    self._values = array('d', bytes(8 * size))
+    self._size = size
+    self._next = 0
+    self.count = 0
+    self.sum = 0.0
+
+  def add(self, value):
+    self._values[self._next] = value
+    self._next += 1
+    if self._next == self._size:
+      self._next = 0
+    self.count += 1
+    self.sum += value
+
+  def values(self):
+    return self._values[:min(self.count, self._size)]
+
+  def quantiles(self, fractions):
+    values = sorted(self.values())
+    if not values:
+      return [0.0 for f in fractions]
+    return [values[min(len(values) - 1, int(f * (len(values) - 1) + 0.5))] for f in fractions]
+
+class TowerMetrics():
+  def __init__(self, size = 4096):
+    # Actual against scheduled time of each strike, late is positive
+    self.lateness = RingBuffer(size)
+    # How long each emit took
+    self.emit = RingBuffer(size)
+    self.rows = 0
+    self.strikes = 0
+    self.calls = {}
+    self.stand_backs = {}
+
+  def sent(self, strike, lateness, emit, payload):
+    ''' Called by the StrikeSender after each message has gone '''
+    self.emit.add(emit)
+    if strike:
+      self.strikes += 1
+      self.lateness.add(lateness)
+    else:
+      call = payload['call']
+      self.calls[call] = self.calls.get(call, 0) + 1
+
+  def stood_back(self, source):
+    self.stand_backs[source] = self.stand_backs.get(source, 0) + 1
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+def _label(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _summary(lines, name, help, towers, buffer):
+  lines.append('# HELP {} {}'.format(name, help))
+  lines.append('# TYPE {} summary'.format(name))
+  for tower in towers:
+    ring = buffer(tower.metrics)
+    tower_id = _label(tower.tower_id)
+    for q, v in zip(QUANTILES, ring.quantiles(QUANTILES)):
+      lines.append('{}{{tower="{}",quantile="{}"}} {}'.format(name, tower_id, q, v))
+    lines.append('{}_sum{{tower="{}"}} {}'.format(name, tower_id, ring.sum))
+    lines.append('{}_count{{tower="{}"}} {}'.format(name, tower_id, ring.count))
+
+def _metric(lines, name, type, help, samples):
+  ''' samples are (labels, value) with labels a dict '''
+  lines.append('# HELP {} {}'.format(name, help))
+  lines.append('# TYPE {} {}'.format(name, type))
+  for labels, value in samples:
+    text = ','.join('{}="{}"'.format(k, _label(v)) for k, v in labels.items())
+    lines.append('{}{{{}}} {}'.format(name, text, value))
+
+def prometheus_text(towers):
+  ''' The metrics of every tower in the Prometheus text exposition format '''
+  lines = []
+  _summary(lines, 'ringingron_strike_lateness_seconds', 'Actual less scheduled strike time', towers, lambda m: m.lateness)
+  _summary(lines, 'ringingron_emit_seconds', 'Time taken to emit a message', towers, lambda m: m.emit)
+  _metric(lines, 'ringingron_rows_total', 'counter', 'Rows rung',
+          [({'tower': t.tower_id}, t.metrics.rows) for t in towers])
+  _metric(lines, 'ringingron_strikes_total', 'counter', 'Strikes sent',
+          [({'tower': t.tower_id}, t.metrics.strikes) for t in towers])
+  _metric(lines, 'ringingron_calls_total', 'counter', 'Calls made by Ron',
+          [({'tower': t.tower_id, 'call': c}, n) for t in towers for c, n in sorted(t.metrics.calls.items())])
+  _metric(lines, 'ringingron_stand_backs_total', 'counter', 'Times Ron stood back and why',
+          [({'tower': t.tower_id, 'source': s}, n) for t in towers for s, n in sorted(t.metrics.stand_backs.items())])
+
+  connections = [(t, t.connection_stats()) for t in towers]
+  events = (('connect', 'connects'), ('reconnect', 'reconnects'), ('disconnect', 'disconnects'), ('failure', 'connect_failures'))
+  _metric(lines, 'ringingron_connection_events_total', 'counter', 'Socket.IO connection events',
+          [({'tower': t.tower_id, 'event': event}, stats[key]) for t, stats in connections for event, key in events])
+  _metric(lines, 'ringingron_dropped_messages_total', 'counter', 'Messages dropped while the connection was down',
+          [({'tower': t.tower_id}, stats['dropped']) for t, stats in connections])
+  _metric(lines, 'ringingron_connect_seconds', 'gauge', 'Time taken to set up the connection',
+          [({'tower': t.tower_id}, stats['connect_time']) for t, stats in connections if stats['connect_time'] is not None])
+  _metric(lines, 'ringingron_connected', 'gauge', 'Whether the connection is up',
+          [({'tower': t.tower_id}, int(stats['connected'])) for t, stats in connections])
+  _metric(lines, 'ringingron_latency_lead_seconds', 'gauge', 'How early strikes are sent to make up for latency',
+          [({'tower': t.tower_id}, t.latency_stats()['lead']) for t in towers])
+  return '\n'.join(lines) + '\n'
+
+class MetricsExporter():
+  ''' Writes the metrics of the towers to a file every interval seconds and/or serves them on a port
+
+  towers is called for the list of towers each time, so it can change as they come and go
+  '''
+  def __init__(self, towers, file = None, port = None, interval = 10.0):
+    self._towers = towers
+    self._file = file
+    self._interval = interval
+    self._stop = threading.Event()
+    self._server = None
+    if file:
+      threading.Thread(target = self._write_loop, daemon = True, name = 'metrics-file').start()
+    if port:
+      exporter = self
+      class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+          body = exporter.text().encode()
+          self.send_response(200)
+          self.send_header('Content-Type', 'text/plain; version=0.0.4')
+          self.send_header('Content-Length', str(len(body)))
+          self.end_headers()
+          self.wfile.write(body)
+
+        def log_message(self, format, *args):
+          pass
+      self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+      threading.Thread(target = self._server.serve_forever, daemon = True, name = 'metrics-http').start()
+
+  def from_config(config, towers):
+    ''' None if neither a [METRICS] file nor port is set '''
+    file = config.get('METRICS', 'file', '')
+    port = config.getint('METRICS', 'port', 0)
+    if not file and not port:
+      return None
+    return MetricsExporter(towers, file, port, config.getfloat('METRICS', 'interval', 10.0))
+
+  def text(self):
+    return prometheus_text(list(self._towers()))
+
+  def write(self):
+    # Swapped in whole so a scrape never sees half a file
+    tmp = self._file + '.tmp'
+    with open(tmp, 'w') as f:
+      f.write(self.text())
+    os.replace(tmp, self._file)
+
+  def _write_loop(self):
+    while not self._stop.wait(self._interval):
+      self._try_write()
+
+  def _try_write(self):
+    # Logged and tried again next time, the directory may only be missing for a while
+    try:
+      self.write()
+    except OSError as e:
+      log.error('Unable to write metrics to %s: %s', self._file, e)
+
+  def close(self):
+    self._stop.set()
+    if self._server:
+      self._server.shutdown()
+    if self._file:
+      self._try_write()
+
+class Profiler():
+  ''' Runs cProfile over a block when switched on, writing the stats to a .prof file
+
+  Only one profile can run at a time, a block entered while another is running (say a
+  second tower on the same event loop) is left unprofiled
+  '''
+  _lock = threading.Lock()
+  _running = False
+
+  def __init__(self, enabled = False, directory = './profiles'):
+    self.enabled = enabled
+    self._directory = directory
+
+  def from_config(config):
+    return Profiler(config.getboolean('PROFILE', 'enabled', False), config.get('PROFILE', 'directory', './profiles'))
+
+  @contextmanager
+  def profile(self, name):
+    if not self.enabled or not Profiler._claim():
+      yield
+      return
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+      yield
+    finally:
+      profile.disable()
+      Profiler._running = False
+      os.makedirs(self._directory, exist_ok = True)
+      profile.dump_stats(os.path.join(self._directory, '{}-{}.prof'.format(name, time.strftime('%Y%m%d-%H%M%S'))))
+
+  def _claim():
+    with Profiler._lock:
+      if Profiler._running:
+        return False
+      Profiler._running = True
+      return True
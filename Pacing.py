@@ -0,0 +1,67 @@
+class PaceFollower():
+  ''' Follows the pace the human ringers are actually ringing at
+
+  Each human strike comes in already matched to its slot, its place in the sequence of
+  strikes and handstroke gaps, by the striking index. The time since the previous
+  human strike divided by the slots between them gives the interbell
+  interval the band is ringing at. That is smoothed with an exponentially weighted
+  average and Ron's own interval is moved towards it, a small step at a time and never
+  more than bounds away from the pace set for the tower. It's a handful of arithmetic
+  per strike so is cheap enough to run for lots of towers at once
+  '''
+  def __init__(self, enabled = True, alpha = 0.1, bounds = 0.15, max_step = 0.01):
+    self.enabled = enabled
+    self.alpha = alpha
+    self.bounds = bounds
+    self.max_step = max_step
+    self._scheduler = None
+    self._nominal = None
+    self._interval = None
+    self._last = None
+    self.estimate = None
+    self.samples = 0
+
+  def start(self, scheduler, nominal):
+    self._scheduler = scheduler
+    self._nominal = nominal
+    self._interval = nominal
+    self._last = None
+    self.estimate = None
+
+  def stop(self):
+    self._scheduler = None
+
+  def set_nominal(self, nominal):
+    ''' The pace for the tower has been changed '''
+    self._nominal = nominal
+    self._interval = nominal
+
+  def strike(self, slot, at):
+    ''' A human has rung in the slot '''
+    if self._scheduler is None:
+      return
+    if self._last is not None and slot > self._last[0]:
+      self._sample((at - self._last[1]) / (slot - self._last[0]))
+    self._last = (slot, at)
+
+  def _sample(self, interval):
+    self.samples += 1
+    if self.estimate is None:
+      self.estimate = interval
+    else:
+      self.estimate += self.alpha * (interval - self.estimate)
+
+    if self.enabled:
+      target = min(max(self.estimate, self._nominal * (1 - self.bounds)), self._nominal * (1 + self.bounds))
+      step = self._nominal * self.max_step
+      self._interval += max(-step, min(step, target - self._interval))
+      self._scheduler.set_interval(self._interval)
+
+  def interval(self):
+    return self._interval
+
+  def stats(self):
+    return {'samples': self.samples,
+            'estimate': self.estimate,
+            'nominal': self._nominal,
+            'interval': self._interval}
@@ -0,0 +1,136 @@
+''' Standard place notation, compiled into permutations so leads can be built by composing them
+
+A change is written as the places made, with x (or -) for all change. Changes are
+separated by '.' or are implied by an x, for example x14x14x14x14x14x12 or
+5.1.5.1.5.1.5.1.5.125. A comma gives the usual shorthand for a symmetrical lead, the
+part before it is rung forwards and back again followed by the part after it, so
+Plain Bob Minor is x14x14x14,12. Places that are implied (lead or lie) may be left out.
+'''
+
+BELL_SYMBOLS = '1234567890ETABCD'
+
+def parse(notation, bells):
+  ''' List of changes, each a set of the 0 based places made '''
+  notation = notation.replace(' ', '')
+  if ',' in notation:
+    ndx = notation.index(',')
+    symmetric = _split(notation[:ndx], bells)
+    return symmetric + symmetric[-2::-1] + _split(notation[ndx + 1:], bells)
+  return _split(notation, bells)
+
+def _split(notation, bells):
+  changes = []
+  places = None
+  for c in notation.lstrip('&+'):
+    if c in 'xX-':
+      if places is not None:
+        changes.append(_implied(places, bells))
+      changes.append(_implied(set(), bells))
+      places = None
+    elif c == '.':
+      if places is not None:
+        changes.append(_implied(places, bells))
+      places = None
+    else:
+      if c.upper() not in BELL_SYMBOLS[:bells]:
+        raise ValueError('Bad place ' + c + ' in place notation for ' + str(bells) + ' bells')
+      if places is None:
+        places = set()
+      places.add(BELL_SYMBOLS.index(c.upper()))
+  if places is not None:
+    changes.append(_implied(places, bells))
+  return changes
+
+def _implied(places, bells):
+  ''' Add the lead or lie that is implied when an odd number of bells is left outside the places '''
+  places = set(places)
+  if places:
+    if min(places) % 2 != 0:
+      places.add(0)
+    if (bells - 1 - max(places)) % 2 != 0:
+      places.add(bells - 1)
+  elif bells % 2 != 0:
+    raise ValueError('Cross changes need an even number of bells')
+  return frozenset(places)
+
+def permutation(change, bells):
+  ''' Permutation for one change, new_row[j] = old_row[perm[j]] '''
+  perm = list(range(bells))
+  ndx = 0
+  while ndx < bells:
+    if ndx in change:
+      ndx += 1
+    elif ndx + 1 < bells and (ndx + 1) not in change:
+      perm[ndx], perm[ndx + 1] = ndx + 1, ndx
+      ndx += 2
+    else:
+      raise ValueError('Places ' + format_change(change, bells) + ' do not make a change')
+  return perm
+
+def lead_permutations(changes, bells):
+  ''' For each row of the lead the permutation that takes the lead head to it '''
+  perms = []
+  current = list(range(bells))
+  for change in changes:
+    p = permutation(change, bells)
+    current = [current[j] for j in p]
+    perms.append(current)
+  return perms
+
+def format_change(change, bells):
+  if not change:
+    return 'x'
+  return ''.join(BELL_SYMBOLS[p] for p in sorted(change))
+
+def changes_between(row, next_row):
+  ''' The places made going from one row to the next '''
+  places = set()
+  for ndx in range(len(row)):
+    if row[ndx] == next_row[ndx]:
+      places.add(ndx)
+  return frozenset(places)
+
+def format_notation(changes, bells):
+  ''' Write changes out as place notation '''
+  text = ''
+  for change in changes:
+    symbol = format_change(change, bells)
+    if symbol == 'x' or text == '' or text[-1] == 'x':
+      text += symbol
+    else:
+      text += '.' + symbol
+  return text
+
+if __name__ == '__main__':
+  # Check that every extent rings exactly the same rows and calls as it does on the tracks, so
+  # making place notation the default never changes a touch. Any difference fails the check
+  import sys
+  import glob
+  from random import seed
+  from Methods import Method, Extent
+
+  files = sys.argv[1:] if len(sys.argv) > 1 else sorted(glob.glob('./data/*.mcf'))
+  failed = 0
+  for file in files:
+    method = Method(file)
+    if not method.place_notation:
+      print('{}: no place notation'.format(method.name))
+      continue
+    key = 1
+    while method.extent_exists(key):
+      extent_id = 'EXTENT-' + str(key)
+      for cover in (False, True):
+        seed(key)
+        extent = Extent(method, extent_id, cover = cover)
+        by_default = [(bytes(row.positions), row.store.calls[row.index]) for row in extent]
+        seed(key)
+        by_tracks = [(bytes(row.positions), row.store.calls[row.index]) for row in Extent(method, extent_id, cover = cover, engine = Extent.ENGINE_TRACKS)]
+        if by_default != by_tracks:
+          failed += 1
+          print('{}: {} differs{}'.format(method.name, extent_id, ' with cover' if cover else ''))
+      if extent.engine == Extent.ENGINE_TRACKS:
+        # A call the place notation doesn't have, the place notation would ring it as a plain lead
+        print('{}: {} is rung on the tracks, the place notation does not have all its calls'.format(method.name, extent_id))
+      key += 1
+    print('{}: checked {} extents'.format(method.name, key - 1))
+  sys.exit(1 if failed else 0)
@@ -1,8 +1,12 @@
 import PySimpleGUI as sg
 
 from tower import Tower
+from async_tower import TowerListener
 from Config import Config
-from Methods import Method
+from MethodLibrary import MethodLibrary
+from TowerInfo import TowerInfoService
+from ExtentCache import ExtentCache
+from Metrics import MetricsExporter
 
 class PlayableExtent():
     def __init__(self, method, extent_key):
@@ -27,11 +31,22 @@ class PlayableExtent():
     def extent_id(self):
         return self.extent_key
 
-def methods_and_extents(mcf_list):
+class GuiListener(TowerListener):
+    ''' Passes Ron's state changes back to the GUI event loop '''
+    def __init__(self, window):
+        self.window = window
+    
+    def stood_back(self, tower, source):
+        self.window.write_event_value('-Ron Stands Back-', source)
+    
+    def extent_proved(self, tower, report):
+        self.window.write_event_value('-Extent Proved-', report)
+
+def methods_and_extents(library):
   method_list = []
   
-  for mcf in mcf_list:
-    mi = Method(('./data/' + mcf[1] + '.mcf'))
+  # Only the library index is used here, the full method is loaded when Ron is asked to ring it
+  for mi in library.methods():
     mi.extents = []
     method_list.append(mi)
     extent_id = 1
@@ -52,17 +67,25 @@ if __name__ == "__main__":
       window['-ADD_COVER-'].update(value = False, disabled = True)
   
   def extent_change(window, values):
-    pass
+    # Generate the extent, and every shuffle of it, while the band is getting ready
+    if values['-EXTENT-']:
+      method = library.method(values['-METHOD-'])
+      extents.precompute_async(method, values['-EXTENT-'].extent_id(), values['-ADD_COVER-'])
     
   config = Config('ringingron.ini')
   
   tower = None
   
-  method_list = methods_and_extents(config.items('MCF'))
+  library = MethodLibrary.from_config(config)
+  towers = TowerInfoService.from_config(config)
+  extents = ExtentCache.from_config(config)
+  metrics = MetricsExporter.from_config(config, lambda: [tower] if tower else [])
+  method_list = methods_and_extents(library)
   
   layout = [ [sg.Text('Enter Tower ID'), sg.Input(key = '-TOWER_ID-', size = (12, 1), enable_events = True), sg.Text('', size = (50, 1),key = '-TOWER_NAME-')],
              [sg.Text('Select method'), sg.Combo(method_list, key = '-METHOD-', enable_events = True, readonly = True)],
              [sg.Text('Select extent'), sg.Combo([], size = (50, 1), key = '-EXTENT-', enable_events = True, readonly = True, disabled = True)],
+             [sg.Text('', size = (70, 1), key = '-TRUTH-')],
              [sg.Text('Set pace of rounds'),
               sg.Slider(key = '-PACE-', range = (2.0, 5.0), default_value = 0.5 * 6, resolution = 0.1, orientation = 'h', enable_events = True),
               sg.Checkbox('Add cover bell', key = '-ADD_COVER-', default = False, enable_events = True, disabled = True)],
@@ -75,8 +98,7 @@ if __name__ == "__main__":
     if event == sg.WIN_CLOSED or event == 'Exit':
       if tower:
         # All down the pub then
-        if tower.is_ron_ready():
-          tower.stand_down()
+        tower.close()
         tower = None
       break
     elif event == '-TOWER_ID-':
@@ -90,21 +112,31 @@ if __name__ == "__main__":
         id = id[:9]
         window['-TOWER_ID-'].update(id)
       if len(id) == 9:
-        tower = Tower(int(id), window)
-        if tower.valid():
-          window['-TOWER_NAME-'].update(tower.name)
-          tower.set_pace(values['-PACE-'])
-        else:
-          sg.popup_ok('Invalid tower ID')
+        if tower:
+          tower.close()
           tower = None
+        # Looked up in the background, the answer comes back as a -TOWER_INFO- event
+        window['-TOWER_NAME-'].update('Looking up tower')
+        towers.lookup_async(int(id), lambda info: window.write_event_value('-TOWER_INFO-', info))
       elif tower:
-        if tower.ron_in_tower():
-          tower.ron_leaves()
+        tower.close()
         tower = None
         window['-TOWER_NAME-'].update('Enter tower ID')
+    elif event == '-TOWER_INFO-':
+      info = values['-TOWER_INFO-']
+      # Ignore it if the tower ID has been changed while it was being looked up
+      if str(info.tower_id) == values['-TOWER_ID-']:
+        if info.valid:
+          tower = Tower(info, GuiListener(window), extents)
+          window['-TOWER_NAME-'].update(tower.name)
+          tower.set_pace(values['-PACE-'])
+        else:
+          # Say why, the name of an invalid tower is what went wrong
+          window['-TOWER_NAME-'].update(info.name)
+          sg.popup_ok('Invalid tower ID')
     elif event == '-METHOD-':
       method_change(window, values)
-    elif event == '-EXTENT-':
+    elif event == '-EXTENT-' or event == '-ADD_COVER-':
       extent_change(window, values)
     elif event == '-PACE-':
       if tower:
@@ -118,7 +150,7 @@ if __name__ == "__main__":
       elif not values['-EXTENT-']:
         sg.popup_ok('Select an extent')
       else:
-        tower.add_method_extent(values['-METHOD-'], values['-EXTENT-'].extent_id(), values['-ADD_COVER-'])
+        tower.add_method_extent(library.method(values['-METHOD-']), values['-EXTENT-'].extent_id(), values['-ADD_COVER-'])
         tower.wait_for_look_to()
         window['Look To Ron'].update(disabled = True)
         window['Stop Ringing Ron'].update(disabled = False)
@@ -127,6 +159,18 @@ if __name__ == "__main__":
       tower.stand_down()
       window['Look To Ron'].update(disabled = False)
       window['Stop Ringing Ron'].update(disabled = True)
+    elif event == '-Extent Proved-':
+      report = values['-Extent Proved-']
+      if not report.provable:
+        window['-TRUTH-'].update('Extent is longer than an extent, not provable as one block')
+      elif report.true():
+        window['-TRUTH-'].update('Extent is true')
+      else:
+        window['-TRUTH-'].update('Extent is false, row {} repeats row {}'.format(report.second + 1, report.first + 1))
     elif event == '-Ron Stands Back-':
       window['Look To Ron'].update(disabled = False)
       window['Stop Ringing Ron'].update(disabled = True)
+  
+  if metrics:
+    metrics.close()
+  library.close()
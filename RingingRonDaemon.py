@@ -0,0 +1,217 @@
+''' Headless Ron, rings in several towers at once without a GUI
+
+Sessions come from the [SESSION-n] sections of ringingron.ini, or from stdin
+when run with '-', one per line as
+
+  tower_id, method name, extent number, pace, cover (yes/no)
+'''
+import sys
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from Config import Config
+from MethodLibrary import MethodLibrary
+from async_tower import AsyncTower, TowerListener
+from TowerInfo import TowerInfoService
+from ExtentCache import ExtentCache
+from Metrics import MetricsExporter
+
+log = logging.getLogger('RingingRon')
+
+class Session():
+  def __init__(self, tower_id, method, extent, pace = 3.0, cover = False):
+    self.tower_id = int(tower_id)
+    self.method = method
+    self.extent = int(extent)
+    self.pace = float(pace)
+    self.cover = cover
+    self.restarts = 0
+
+  def __str__(self):
+    return '{} {} extent {}'.format(self.tower_id, self.method, self.extent)
+
+  def from_line(line):
+    ''' tower, method, extent[, pace[, cover]] separated by commas, ValueError if the line isn't one '''
+    fields = [f.strip() for f in line.split(',')]
+    if len(fields) < 3 or len(fields) > 5:
+      raise ValueError('Expected tower, method, extent[, pace[, cover]] in session line: {}'.format(line.strip()))
+    cover = len(fields) > 4 and fields[4].lower() in ('yes', 'true', '1')
+    try:
+      return Session(fields[0], fields[1], fields[2], *fields[3:4], cover = cover)
+    except ValueError:
+      raise ValueError('Bad tower, extent or pace in session line: {}'.format(line.strip()))
+
+  def from_config(config):
+    sessions = []
+    ndx = 1
+    while config.has_section('SESSION-' + str(ndx)):
+      section = 'SESSION-' + str(ndx)
+      sessions.append(Session(config.getint(section, 'tower'),
+                              config.get(section, 'method'),
+                              config.getint(section, 'extent'),
+                              config.getfloat(section, 'pace', 3.0),
+                              config.getboolean(section, 'cover', False)))
+      ndx += 1
+    return sessions
+
+class LoggingListener(TowerListener):
+  def waiting_for_look_to(self, tower):
+    log.info('%s: waiting for look to', tower.tower_id)
+
+  def ringing(self, tower):
+    log.info('%s: ringing', tower.tower_id)
+
+  def stood_back(self, tower, source):
+    log.info('%s: stood back (%s)', tower.tower_id, source)
+
+class Supervisor():
+  ''' Runs sessions on a bounded pool of workers and restarts the ones that fail '''
+  def __init__(self, workers, restart_delay, max_restarts, repeat, listener, library, towers, extents):
+    self._workers = workers
+    self._restart_delay = restart_delay
+    self._max_restarts = max_restarts
+    self._repeat = repeat
+    self._listener = listener
+    self._library = library
+    self._tower_info = towers
+    self._extents = extents
+    self._queue = asyncio.Queue()
+    self._towers = {}
+    self._pending = set()
+    # Methods are loaded and extents built and proved in here, off the loop every tower
+    # rings on. One thread as the library isn't shared between threads
+    self._loader = ThreadPoolExecutor(1, thread_name_prefix = 'loader')
+
+  def towers(self):
+    return list(self._towers.values())
+
+  async def run(self, sessions):
+    for session in sessions:
+      # A method or extent that doesn't exist won't come right by trying again
+      problem = self.check(session)
+      if problem:
+        log.error('%s: %s, not ringing it', session, problem)
+      else:
+        self._queue.put_nowait(session)
+    workers = [asyncio.create_task(self._worker()) for ndx in range(self._workers)]
+    try:
+      # Sessions waiting to restart aren't in the queue so wait for them as well
+      while True:
+        await self._queue.join()
+        if not self._pending:
+          break
+        await asyncio.wait(self._pending)
+    finally:
+      for tower in self._towers.values():
+        tower.stand_down()
+      for worker in workers:
+        worker.cancel()
+      await asyncio.gather(*workers, return_exceptions = True)
+      await asyncio.gather(*[tower.close() for tower in self._towers.values()], return_exceptions = True)
+      self._loader.shutdown(wait = False)
+
+  def check(self, session):
+    ''' What is wrong with the method and extent of a session from the library index, None if nothing '''
+    info = self._library.find(session.method)
+    if info is None:
+      return 'no method called {}'.format(session.method)
+    if not info.extent_exists(session.extent):
+      return '{} has no extent {}'.format(info.name, session.extent)
+    return None
+
+  async def _worker(self):
+    while True:
+      session = await self._queue.get()
+      try:
+        await self._ring(session)
+        if self._repeat:
+          session.restarts = 0
+          self._queue.put_nowait(session)
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        log.exception('%s: session failed', session)
+        self._restart(session)
+      finally:
+        self._queue.task_done()
+
+  async def _ring(self, session):
+    tower = self._towers.get(session.tower_id)
+    if tower is None:
+      # Looked up in the service's threads so the towers are all found at once
+      info = await asyncio.wrap_future(self._tower_info.lookup_async(session.tower_id))
+      if not info.valid:
+        raise ValueError('{}: {}'.format(session.tower_id, info.name))
+      tower = AsyncTower(info, self._listener, self._extents)
+      self._towers[session.tower_id] = tower
+    tower.set_pace(session.pace)
+    extent_id = 'EXTENT-' + str(session.extent)
+    method, cover = await asyncio.get_running_loop().run_in_executor(self._loader, self._load, session, extent_id)
+    # Made and proved already so this is a cache lookup
+    tower.add_method_extent(method, extent_id, cover)
+    tower.prepare()
+    await tower.ron()
+
+  def _load(self, session, extent_id):
+    ''' Load the method and have the extent (every shuffle of a mutable one) ready in the cache '''
+    method = self._library.method(session.method)
+    cover = session.cover and method.coverable()
+    self._extents.precompute(method, extent_id, cover)
+    return method, cover
+
+  def _restart(self, session):
+    session.restarts += 1
+    if session.restarts > self._max_restarts:
+      log.error('%s: giving up after %d restarts', session, self._max_restarts)
+      return
+    # Back off a bit longer each time so a tower that is down isn't hammered
+    delay = self._restart_delay * session.restarts
+    log.info('%s: restarting in %.1f seconds', session, delay)
+    # Start again from a fresh connection
+    tower = self._towers.pop(session.tower_id, None)
+    if tower:
+      asyncio.create_task(tower.close())
+    task = asyncio.create_task(self._requeue(session, delay))
+    self._pending.add(task)
+    task.add_done_callback(self._pending.discard)
+
+  async def _requeue(self, session, delay):
+    await asyncio.sleep(delay)
+    self._queue.put_nowait(session)
+
+if __name__ == '__main__':
+  logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(message)s')
+
+  config = Config('ringingron.ini')
+
+  if len(sys.argv) > 1 and sys.argv[1] == '-':
+    sessions = []
+    for line in sys.stdin:
+      if line.strip() and not line.startswith('#'):
+        # A bad line is left out rather than stopping every other session
+        try:
+          sessions.append(Session.from_line(line))
+        except ValueError as e:
+          log.error('%s', e)
+  else:
+    sessions = Session.from_config(config)
+
+  library = MethodLibrary.from_config(config)
+  supervisor = Supervisor(config.getint('DAEMON', 'workers', 4),
+                          config.getfloat('DAEMON', 'restart_delay', 5.0),
+                          config.getint('DAEMON', 'max_restarts', 5),
+                          config.getboolean('DAEMON', 'repeat', True),
+                          LoggingListener(),
+                          library,
+                          TowerInfoService.from_config(config),
+                          ExtentCache.from_config(config))
+  metrics = MetricsExporter.from_config(config, supervisor.towers)
+  try:
+    asyncio.run(supervisor.run(sessions))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if metrics:
+      metrics.close()
+    library.close()
@@ -0,0 +1,127 @@
+import asyncio
+from time import monotonic, sleep
+
+class Scheduler():
+  ''' Works out when each strike is due on an absolute clock and sleeps until then '''
+
+  def __init__(self, pace, number_of_bells, clock = monotonic, sleeper = sleep):
+    self._clock = clock
+    self._sleeper = sleeper
+    self._number_of_bells = number_of_bells
+    self._interval = pace / number_of_bells
+    self._pending_interval = None
+    # Deadlines are worked out as base + count * interval so that rounding errors
+    # and sleep overshoot never accumulate, the base only moves when the pace changes
+    self._base = None
+    self._count = 0
+    # Every strike and handstroke gap since the start of the touch
+    self.slot = 0
+    # How far the whole schedule has slipped after Ron was held up
+    self._offset = 0.0
+    self.strikes = 0
+    self.late_strikes = 0
+    self.max_lateness = 0.0
+    self.total_lateness = 0.0
+    self.slips = 0
+
+  def start(self, at = None):
+    ''' Start of the touch, every later deadline is measured from here '''
+    self._base = self._clock() if at is None else at
+    self._count = 0
+    self.slot = 0
+    self._offset = 0.0
+
+  def set_pace(self, pace):
+    # Picked up by the ringing thread at the next strike so there is no need for a lock
+    self._pending_interval = pace / self._number_of_bells
+
+  def set_interval(self, interval):
+    self._pending_interval = interval
+
+  def interval(self):
+    return self._interval
+
+  def next_deadline(self):
+    return self._base + self._count * self._interval
+
+  def actual_deadline(self, deadline):
+    ''' When a strike given deadline is due now, after the schedule has slipped '''
+    return deadline + self._offset
+
+  def handstroke_gap(self):
+    ''' The open handstroke lead is one extra interbell gap '''
+    self._advance()
+
+  def next_strike(self):
+    ''' Deadline of the next strike, moving the schedule on past it without waiting '''
+    deadline = self.next_deadline()
+    self._advance()
+    return deadline
+
+  def wait(self):
+    ''' Sleep until the next strike is due, returns how late it actually was '''
+    return self.wait_until(self.next_strike())
+
+  async def wait_async(self):
+    ''' Same as wait but yields to the event loop rather than blocking the thread '''
+    return await self.wait_until_async(self.next_strike())
+
+  def wait_until(self, deadline, strike = True):
+    remaining = deadline + self._offset - self._clock()
+    if remaining > 0:
+      self._sleeper(remaining)
+    return self._struck(deadline, strike)
+
+  async def wait_until_async(self, deadline, strike = True, interrupt = None):
+    ''' Yield until the deadline, or None straight away if the interrupt event is set while waiting '''
+    remaining = deadline + self._offset - self._clock()
+    if interrupt is not None:
+      if interrupt.is_set():
+        return None
+      if remaining > 0:
+        try:
+          await asyncio.wait_for(interrupt.wait(), remaining)
+          return None
+        except asyncio.TimeoutError:
+          pass
+    elif remaining > 0:
+      await asyncio.sleep(remaining)
+    return self._struck(deadline, strike)
+
+  def _struck(self, deadline, strike = True):
+    lateness = self._clock() - (deadline + self._offset)
+    if not strike:
+      # Calls go out on the same schedule but don't count towards the striking
+      return lateness
+    self._record(lateness)
+
+    # A strike that is late is rung straight away and the following strikes keep to
+    # their original deadlines. If Ron has been stalled for longer than a whole gap the
+    # schedule slips instead, otherwise he would fire off a burst of strikes to catch up
+    if lateness > self._interval:
+      self._offset += lateness
+      self.slips += 1
+
+    return lateness
+
+  def _advance(self):
+    self._count += 1
+    self.slot += 1
+    if self._pending_interval is not None:
+      # Rebase on the deadline just reached so the new pace starts from here
+      self._base = self.next_deadline()
+      self._count = 0
+      self._interval = self._pending_interval
+      self._pending_interval = None
+
+  def _record(self, lateness):
+    self.strikes += 1
+    if lateness > 0:
+      self.late_strikes += 1
+      self.total_lateness += lateness
+      self.max_lateness = max(self.max_lateness, lateness)
+
+  def mean_lateness(self):
+    if self.strikes == 0:
+      return 0.0
+    return self.total_lateness / self.strikes
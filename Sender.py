@@ -0,0 +1,81 @@
+import asyncio
+
+class StrikePayloads():
+  ''' Every message Ron can send while ringing an extent, made once rather than on every strike '''
+  def __init__(self, tower_id, number_of_bells):
+    self.strikes = {}
+    for bell in range(1, number_of_bells + 1):
+      for stroke in (True, False):
+        self.strikes[(bell, stroke)] = {'bell': bell, 'tower_id': tower_id, 'stroke': stroke}
+    self.calls = {}
+    for call in ('Go', 'Bob', 'Single', "That's all", 'Stand next'):
+      self.calls[call] = {'call': call, 'tower_id': tower_id}
+
+  def strike(self, bell, stroke):
+    return self.strikes[(bell, stroke)]
+
+  def call(self, call):
+    return self.calls[call]
+
+class StrikeSender():
+  ''' Sends queued messages at their scheduled time so the socket is kept out of the ringing loop
+
+  The ringing loop runs a little ahead putting (deadline, event, payload) on the queue,
+  the sender waits for each deadline on the scheduler and emits it. Setting the stopped
+  event wakes the sender at once, even part way through waiting for a strike
+  '''
+  def __init__(self, emit, scheduler, depth, stopped, latency, log = None, metrics = None):
+    self._emit = emit
+    # Optional StrikeLog of everything sent along with when it was meant to go
+    self._log = log
+    # Optional TowerMetrics that are told how late and how long each message was
+    self._metrics = metrics
+    self._latency = latency
+    self._scheduler = scheduler
+    self._stopped = stopped
+    self._queue = asyncio.Queue(depth)
+    self._clock = asyncio.get_running_loop().time
+    self.sent = 0
+    self.max_depth = 0
+    self.total_emit_time = 0.0
+    self.max_emit_time = 0.0
+
+  async def put(self, deadline, event, payload, strike = True):
+    await self._queue.put((deadline, event, payload, strike))
+    self.max_depth = max(self.max_depth, self._queue.qsize())
+
+  async def finish(self):
+    ''' Let the sender empty the queue and stop '''
+    await self._queue.put(None)
+
+  def depth(self):
+    return self._queue.qsize()
+
+  def mean_emit_time(self):
+    if self.sent == 0:
+      return 0.0
+    return self.total_emit_time / self.sent
+
+  async def run(self):
+    while True:
+      item = await self._queue.get()
+      if item is None:
+        break
+      deadline, event, payload, strike = item
+      # Sent early by the one way latency to the server so it arrives on time
+      lateness = await self._scheduler.wait_until_async(deadline - self._latency.lead(), strike, self._stopped)
+      if lateness is None:
+        # Ron has been stood down, anything still queued is thrown away
+        continue
+      start = self._clock()
+      if strike:
+        self._latency.sent(payload['bell'], start)
+      await self._emit(event, payload)
+      if self._log is not None:
+        self._log.record(start, deadline, event, payload)
+      elapsed = self._clock() - start
+      self.sent += 1
+      self.total_emit_time += elapsed
+      self.max_emit_time = max(self.max_emit_time, elapsed)
+      if self._metrics is not None:
+        self._metrics.sent(strike, lateness, elapsed, payload)
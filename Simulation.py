@@ -0,0 +1,208 @@
+''' Rings a touch against an in-process stand in for RingingRoom in simulated time
+
+The ringing is done by the real AsyncTower, only the socket and the clock are not real.
+The event loop's clock only moves forward when the loop would otherwise sleep, at which
+point it jumps straight to the next thing due, so a whole extent takes milliseconds.
+
+  python Simulation.py "data/Plain Bob Doubles.mcf" 1 --pace 3 --log touch.csv
+'''
+import sys
+import time
+import asyncio
+import argparse
+import selectors
+
+from Methods import Method
+from TowerInfo import TowerInfo
+from async_tower import AsyncTower
+
+class VirtualSelector(selectors.BaseSelector):
+  ''' A selector that never waits for a timeout, it moves the loop's clock on instead '''
+  def __init__(self, loop):
+    self._loop = loop
+    self._selector = selectors.DefaultSelector()
+
+  def register(self, fileobj, events, data = None):
+    return self._selector.register(fileobj, events, data)
+
+  def unregister(self, fileobj):
+    return self._selector.unregister(fileobj)
+
+  def modify(self, fileobj, events, data = None):
+    return self._selector.modify(fileobj, events, data)
+
+  def select(self, timeout = None):
+    if timeout is None:
+      # Nothing is scheduled, only another thread (an executor) can wake the loop
+      return self._selector.select(None)
+    events = self._selector.select(0)
+    if not events and timeout > 0:
+      self._loop.advance(timeout)
+    return events
+
+  def get_map(self):
+    return self._selector.get_map()
+
+  def close(self):
+    self._selector.close()
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+  ''' Event loop whose time() is simulated, it starts at zero '''
+  def __init__(self):
+    self._now = 0.0
+    super().__init__(VirtualSelector(self))
+
+  def time(self):
+    return self._now
+
+  def advance(self, seconds):
+    self._now += seconds
+
+class SimulatedClient():
+  ''' Stands in for socketio.AsyncClient, everything goes to and from a SimulatedServer '''
+  def __init__(self, server):
+    self._server = server
+    self._handlers = {}
+    self.connected = False
+
+  def on(self, event, handler):
+    self._handlers[event] = handler
+
+  async def connect(self, url):
+    self.connected = True
+    self._server.attach(self)
+    self.receive('connect')
+
+  async def disconnect(self):
+    self.connected = False
+    self._server.detach(self)
+    self.receive('disconnect')
+
+  async def emit(self, event, data):
+    # Takes the one way latency to get to the server
+    asyncio.get_running_loop().call_later(self._server.latency, self._server.receive, self, event, data)
+
+  def receive(self, event, *data):
+    handler = self._handlers.get(event)
+    if handler:
+      result = handler(*data)
+      if asyncio.iscoroutine(result):
+        asyncio.ensure_future(result)
+
+class SimulatedServer():
+  ''' Just enough of a RingingRoom tower to ring in, messages take latency seconds each way '''
+  def __init__(self, latency = 0.0, humans = None):
+    self.latency = latency
+    # Bells rung by (pretend) humans, bell: user name
+    self.humans = dict(humans) if humans else {}
+    self.bell_state = []
+    self.received = {}
+    self._clients = []
+
+  def attach(self, client):
+    self._clients.append(client)
+
+  def detach(self, client):
+    if client in self._clients:
+      self._clients.remove(client)
+
+  def receive(self, client, event, data):
+    self.received[event] = self.received.get(event, 0) + 1
+    if event in ('c_join', 'c_request_global_state'):
+      for bell, user in self.humans.items():
+        self._send(client, 's_assign_user', {'bell': bell, 'user': user})
+    elif event == 'c_size_change':
+      self.bell_state = [True] * data['new_size']
+    elif event == 'c_set_bells':
+      self.bell_state = [True] * len(self.bell_state)
+    elif event == 'c_bell_rung':
+      bell = data['bell']
+      if 0 < bell <= len(self.bell_state):
+        self.bell_state[bell - 1] = not self.bell_state[bell - 1]
+      self.broadcast('s_bell_rung', {'who_rang': bell, 'global_bell_state': list(self.bell_state)})
+    elif event == 'c_call':
+      self.broadcast('s_call', {'call': data['call']})
+    elif event == 'c_user_left':
+      self.broadcast('s_user_left', {'user_name': 'Ron'})
+
+  def call(self, call):
+    ''' A call made by someone else in the tower '''
+    self.broadcast('s_call', {'call': call})
+
+  def broadcast(self, event, data):
+    for client in self._clients:
+      self._send(client, event, data)
+
+  def _send(self, client, event, data):
+    asyncio.get_running_loop().call_later(self.latency, client.receive, event, data)
+
+class SimulatedTower(AsyncTower):
+  ''' An AsyncTower connected to a SimulatedServer, always keeps a strike log '''
+  def __init__(self, server, listener = None, extents = None):
+    super().__init__(TowerInfo(0, 'Simulation', 'simulation'), listener, extents)
+    self.server = server
+    self.log_strikes()
+    # Why Ron stopped ringing
+    self.stood_back = None
+
+  def _new_client(self):
+    return SimulatedClient(self.server)
+
+  def _stand_back_ron(self, source):
+    # The first reason given is the one that stopped him
+    if self.stood_back is None:
+      self.stood_back = source
+    super()._stand_back_ron(source)
+
+async def _simulate(tower, server, look_to, calls):
+  loop = asyncio.get_running_loop()
+  loop.call_later(look_to, server.call, 'Look to')
+  for at, call in calls:
+    loop.call_later(look_to + at, server.call, call)
+  await tower.ron()
+  await tower.close()
+
+def simulate(method, extent_id, cover = False, pace = 3.0, latency = 0.0, humans = None, look_to = 1.0, calls = (), listener = None):
+  ''' Ring an extent in simulated time and return the SimulatedTower, its strike_log has every strike
+
+  calls are (seconds after look to, call) made from the tower, such as (30.0, 'Stand next')
+  '''
+  server = SimulatedServer(latency, humans)
+  tower = SimulatedTower(server, listener)
+  tower.set_pace(pace)
+  tower.add_method_extent(method, extent_id, cover)
+  tower.prepare()
+  loop = VirtualClockLoop()
+  try:
+    loop.run_until_complete(_simulate(tower, server, look_to, calls))
+  finally:
+    loop.close()
+  return tower
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Ring an extent in simulated time')
+  parser.add_argument('file', help = 'method .mcf file')
+  parser.add_argument('extent', type = int, help = 'extent number')
+  parser.add_argument('--pace', type = float, default = 3.0, help = 'seconds for a row of rounds')
+  parser.add_argument('--cover', action = 'store_true')
+  parser.add_argument('--latency', type = float, default = 0.0, help = 'one way latency to the server in seconds')
+  parser.add_argument('--stand', type = float, default = None, help = "call 'Stand next' this many seconds after look to")
+  parser.add_argument('--log', default = None, help = 'write the strike log to this file')
+  args = parser.parse_args()
+
+  method = Method(args.file)
+  calls = [(args.stand, 'Stand next')] if args.stand is not None else []
+  start = time.perf_counter()
+  tower = simulate(method, 'EXTENT-' + str(args.extent), args.cover and method.coverable(), args.pace, args.latency, calls = calls)
+  elapsed = time.perf_counter() - start
+
+  log = tower.strike_log
+  strikes = log.strikes() if log else []
+  print(tower.truth)
+  print('{} strikes, {} calls, {:.1f}s of ringing in {:.3f}s, stood back: {}'.format(
+    len(strikes), len(log) - len(strikes) if log else 0,
+    strikes[-1].at - strikes[0].at if strikes else 0.0, elapsed, tower.stood_back))
+  print('latency: {}'.format(tower.latency_stats()))
+  if args.log and log:
+    log.write(args.log)
+    print('Strike log written to ' + args.log, file = sys.stderr)
@@ -0,0 +1,143 @@
+''' A local stand in for a RingingRoom server, for load testing Ron without the real thing
+
+It understands the events Ron sends and answers with the ones he listens for. Each tower
+is a Socket.IO room. The tower can be scripted to call 'Look to' a while after Ron has
+set the bells and 'Stand next' a while after that, so towers ring without anyone there.
+
+  python StandInServer.py --port 8765 --look-to 1.0 --stand 60
+
+Ron is pointed at it with a TowerInfo whose server_ip is http://127.0.0.1:8765, the
+tower page is served as well so a TowerInfoService with its URL changed also works.
+'''
+import asyncio
+import argparse
+
+import socketio
+from aiohttp import web
+
+class StandInTower():
+  def __init__(self, tower_id):
+    self.tower_id = tower_id
+    self.size = 0
+    self.bell_state = []
+    # Bells rung by (pretend) humans, bell: user name
+    self.users = {}
+    self.script = None
+
+class StandInServer():
+  ''' Implements c_join, c_request_global_state, c_size_change, c_set_bells, c_bell_rung,
+  c_call and c_user_left, sending s_assign_user, s_bell_rung, s_call and s_user_left '''
+  def __init__(self, look_to = 1.0, stand = None, humans = None):
+    self.look_to = look_to
+    self.stand = stand
+    self.humans = dict(humans) if humans else {}
+    self.towers = {}
+    self.received = {}
+    self.sio = socketio.AsyncServer(async_mode = 'aiohttp', cors_allowed_origins = '*')
+    self.app = web.Application()
+    self.sio.attach(self.app)
+    self.app.router.add_get('/{tower_id}', self._tower_page)
+    for event in ('c_join', 'c_request_global_state', 'c_size_change', 'c_set_bells', 'c_bell_rung', 'c_call', 'c_user_left'):
+      self.sio.on(event, getattr(self, '_' + event))
+
+  def _tower(self, data):
+    tower_id = data['tower_id']
+    tower = self.towers.get(tower_id)
+    if tower is None:
+      tower = self.towers[tower_id] = StandInTower(tower_id)
+      tower.users = dict(self.humans)
+    return tower
+
+  def _count(self, event):
+    self.received[event] = self.received.get(event, 0) + 1
+
+  async def _tower_page(self, request):
+    tower_id = request.match_info['tower_id']
+    host = request.host
+    html = ('<script>window.tower_parameters = {{name: "Stand in {}", server_ip: "http://{}"}};</script>'
+            .format(tower_id, host))
+    return web.Response(text = html, content_type = 'text/html')
+
+  async def _c_join(self, sid, data):
+    self._count('c_join')
+    tower = self._tower(data)
+    await self.sio.enter_room(sid, str(tower.tower_id))
+
+  async def _c_request_global_state(self, sid, data):
+    self._count('c_request_global_state')
+    tower = self._tower(data)
+    for bell, user in tower.users.items():
+      await self.sio.emit('s_assign_user', {'bell': bell, 'user': user}, to = sid)
+
+  async def _c_size_change(self, sid, data):
+    self._count('c_size_change')
+    tower = self._tower(data)
+    tower.size = data['new_size']
+    tower.bell_state = [True] * tower.size
+    await self.sio.emit('s_size_change', {'size': tower.size}, room = str(tower.tower_id))
+
+  async def _c_set_bells(self, sid, data):
+    self._count('c_set_bells')
+    tower = self._tower(data)
+    tower.bell_state = [True] * tower.size
+    await self.sio.emit('s_global_state', {'global_bell_state': tower.bell_state}, room = str(tower.tower_id))
+    # Setting the bells is the last thing Ron does before waiting for 'Look to'
+    if self.look_to is not None:
+      if tower.script:
+        tower.script.cancel()
+      tower.script = asyncio.ensure_future(self._script(tower))
+
+  async def _script(self, tower):
+    await asyncio.sleep(self.look_to)
+    await self._call(tower, 'Look to')
+    if self.stand is not None:
+      await asyncio.sleep(self.stand)
+      await self._call(tower, 'Stand next')
+
+  async def _c_bell_rung(self, sid, data):
+    self._count('c_bell_rung')
+    tower = self._tower(data)
+    bell = data['bell']
+    if 0 < bell <= len(tower.bell_state):
+      tower.bell_state[bell - 1] = not tower.bell_state[bell - 1]
+    await self.sio.emit('s_bell_rung', {'global_bell_state': tower.bell_state, 'who_rang': bell, 'disagree': False},
+                        room = str(tower.tower_id))
+
+  async def _c_call(self, sid, data):
+    self._count('c_call')
+    await self._call(self._tower(data), data['call'])
+
+  async def _call(self, tower, call):
+    await self.sio.emit('s_call', {'call': call}, room = str(tower.tower_id))
+
+  async def _c_user_left(self, sid, data):
+    self._count('c_user_left')
+    tower = self._tower(data)
+    if tower.script:
+      tower.script.cancel()
+      tower.script = None
+    await self.sio.emit('s_user_left', {'user_name': 'Ron'}, room = str(tower.tower_id))
+    await self.sio.leave_room(sid, str(tower.tower_id))
+
+  async def start(self, host = '127.0.0.1', port = 8765):
+    ''' Start serving on the running event loop, returns the aiohttp runner to clean up with '''
+    runner = web.AppRunner(self.app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+  def run(self, host = '127.0.0.1', port = 8765):
+    web.run_app(self.app, host = host, port = port, print = None)
+
+def serve(host, port, look_to, stand):
+  ''' Entry point for running the server in its own process '''
+  StandInServer(look_to, stand).run(host, port)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Local stand in for a RingingRoom server')
+  parser.add_argument('--host', default = '127.0.0.1')
+  parser.add_argument('--port', type = int, default = 8765)
+  parser.add_argument('--look-to', type = float, default = 1.0, help = "call 'Look to' this many seconds after Ron sets the bells")
+  parser.add_argument('--stand', type = float, default = None, help = "call 'Stand next' this many seconds after 'Look to'")
+  args = parser.parse_args()
+  serve(args.host, args.port, args.look_to, args.stand)
@@ -0,0 +1,142 @@
+''' A log of every strike and call Ron sends, and a replay of one through the scheduler
+
+Each line of the CSV is when the message was sent, when it was scheduled for, the bell
+and stroke (H or B) of a strike or the call made. Times are seconds on the clock the
+touch was rung on. To replay a log at ten times the speed it was rung:
+
+  python StrikeLog.py reports/123456789-20260101-190000.log.csv --speed 10
+'''
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+from Scheduler import Scheduler
+
+class StrikeLogEntry():
+  __slots__ = ('at', 'scheduled', 'bell', 'stroke', 'call')
+
+  def __init__(self, at, scheduled, bell = None, stroke = None, call = None):
+    self.at = at
+    self.scheduled = scheduled
+    self.bell = bell
+    self.stroke = stroke
+    self.call = call
+
+class StrikeLog():
+  HEADER = 'at,scheduled,bell,stroke,call'
+
+  def __init__(self, entries = None):
+    self.entries = entries if entries is not None else []
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __iter__(self):
+    return iter(self.entries)
+
+  def record(self, at, scheduled, event, payload):
+    ''' Called by the StrikeSender after each message has gone '''
+    if event == 'c_bell_rung':
+      self.entries.append(StrikeLogEntry(at, scheduled, payload['bell'], payload['stroke']))
+    elif event == 'c_call':
+      self.entries.append(StrikeLogEntry(at, scheduled, call = payload['call']))
+
+  def strikes(self):
+    return [e for e in self.entries if e.bell is not None]
+
+  def text(self):
+    lines = [StrikeLog.HEADER]
+    for e in self.entries:
+      if e.bell is not None:
+        lines.append('{:.6f},{:.6f},{},{},'.format(e.at, e.scheduled, e.bell, 'H' if e.stroke else 'B'))
+      else:
+        lines.append('{:.6f},{:.6f},,,{}'.format(e.at, e.scheduled, e.call))
+    return '\n'.join(lines) + '\n'
+
+  def write(self, file):
+    with open(file, 'w') as f:
+      f.write(self.text())
+    return file
+
+  def write_log(self, directory, tower_id):
+    os.makedirs(directory, exist_ok = True)
+    return self.write(os.path.join(directory, '{}-{}.log.csv'.format(tower_id, time.strftime('%Y%m%d-%H%M%S'))))
+
+  def read(file):
+    entries = []
+    with open(file, 'r') as f:
+      for line in f:
+        line = line.rstrip('\n')
+        if not line or line == StrikeLog.HEADER:
+          continue
+        at, scheduled, bell, stroke, call = line.split(',', 4)
+        if bell:
+          entries.append(StrikeLogEntry(float(at), float(scheduled), int(bell), stroke == 'H'))
+        else:
+          entries.append(StrikeLogEntry(float(at), float(scheduled), call = call))
+    return StrikeLog(entries)
+
+class ReplayReport():
+  ''' How the log was struck when it was recorded and how well the scheduler kept to it on replay '''
+  def __init__(self, log, scheduler, speed):
+    strikes = log.strikes()
+    errors = [e.at - e.scheduled for e in strikes]
+    self.strikes = len(strikes)
+    self.calls = len(log) - len(strikes)
+    self.speed = speed
+    self.recorded_mean = sum(errors) / len(errors) if errors else 0.0
+    self.recorded_max = max(errors, key = abs) if errors else 0.0
+    self.replay_mean = scheduler.mean_lateness()
+    self.replay_max = scheduler.max_lateness
+    self.replay_slips = scheduler.slips
+
+  def __str__(self):
+    return ('{} strikes, {} calls\n'
+            'recorded: mean {:.2f}ms, worst {:.2f}ms\n'
+            'replayed at x{}: mean late {:.2f}ms, worst {:.2f}ms, {} slips').format(
+              self.strikes, self.calls, self.recorded_mean * 1000, self.recorded_max * 1000,
+              self.speed, self.replay_mean * 1000, self.replay_max * 1000, self.replay_slips)
+
+async def replay(log, speed = 1.0, emit = None):
+  ''' Feed the log back through a Scheduler, speed times as fast as it was recorded
+
+  emit(entry) is called as each entry comes due. Lateness is measured on the replay
+  clock, so at high speeds it is the scheduler's own overhead that is being measured
+  '''
+  loop = asyncio.get_running_loop()
+  entries = list(log)
+  if not entries:
+    return None
+  first = entries[0].scheduled
+  # Only the clock and lateness figures of the scheduler are used, deadlines come from the log.
+  # Its interval is the mean gap between strikes so a stall slips the replay like it would a touch
+  strikes = log.strikes()
+  gap = 1.0
+  if len(strikes) > 1:
+    gap = (strikes[-1].scheduled - strikes[0].scheduled) / (len(strikes) - 1) / speed
+  scheduler = Scheduler(gap, 1, clock = loop.time)
+  start = loop.time()
+  for entry in entries:
+    deadline = start + (entry.scheduled - first) / speed
+    await scheduler.wait_until_async(deadline, entry.bell is not None)
+    if emit:
+      emit(entry)
+  return ReplayReport(log, scheduler, speed)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Replay a strike log through the scheduler')
+  parser.add_argument('log', help = 'strike log .csv')
+  parser.add_argument('--speed', type = float, default = 1.0, help = 'how many times faster than it was rung')
+  parser.add_argument('--print', action = 'store_true', help = 'print each strike and call as it is replayed')
+  args = parser.parse_args()
+
+  def show(entry):
+    if entry.bell is not None:
+      print('{:10.3f} {:2} {}'.format(entry.scheduled, entry.bell, 'H' if entry.stroke else 'B'))
+    else:
+      print('{:10.3f}    {}'.format(entry.scheduled, entry.call))
+
+  report = asyncio.run(replay(StrikeLog.read(args.log), args.speed, show if args.print else None))
+  print(report if report else 'Empty log', file = sys.stderr)
@@ -0,0 +1,118 @@
+import os
+import time
+import math
+from collections import deque
+
+class BellStriking():
+  ''' Running figures for how one bell is being struck, errors are in seconds, late is positive '''
+  __slots__ = ('bell', 'strikes', 'mean', 'm2', 'early', 'late', 'out_of_place', 'missed')
+
+  def __init__(self, bell):
+    self.bell = bell
+    self.strikes = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.early = 0
+    self.late = 0
+    self.out_of_place = 0
+    self.missed = 0
+
+  def add(self, error, tolerance, interval):
+    # Welford's running mean and variance so nothing has to be kept per strike
+    self.strikes += 1
+    delta = error - self.mean
+    self.mean += delta / self.strikes
+    self.m2 += delta * (error - self.mean)
+    if error < -tolerance:
+      self.early += 1
+    elif error > tolerance:
+      self.late += 1
+    # More than half a gap out and the bell has struck in another bell's place
+    if abs(error) > interval / 2:
+      self.out_of_place += 1
+
+  def sd(self):
+    if self.strikes < 2:
+      return 0.0
+    return math.sqrt(self.m2 / (self.strikes - 1))
+
+class StrikeMatch():
+  __slots__ = ('row', 'place', 'slot', 'deadline', 'error')
+
+  def __init__(self, row, place, slot, deadline, error):
+    self.row = row
+    self.place = place
+    self.slot = slot
+    self.deadline = deadline
+    self.error = error
+
+class StrikingIndex():
+  ''' Where and when each human bell is due, built up row by row as the touch is rung
+
+  For each bell there is a queue of (row, place, slot, deadline) in the order the
+  bell will ring them. A strike coming in is matched against the front of its bell's
+  queue, anything it has passed is a missed strike, so matching is constant time.
+  Deadlines are kept as scheduled and put through actual, if given, when a strike is
+  matched so a slip in the schedule after they were queued is allowed for
+  '''
+  def __init__(self, tolerance = 0.05):
+    self.tolerance = tolerance
+    self._expected = {}
+    self.bells = {}
+    self._interval = None
+    self._actual = None
+
+  def start(self, interval, actual = None):
+    self._expected = {}
+    self.bells = {}
+    self._interval = interval
+    self._actual = actual
+
+  def set_interval(self, interval):
+    self._interval = interval
+
+  def expect(self, bell, row, place, slot, deadline):
+    expected = self._expected.get(bell)
+    if expected is None:
+      expected = self._expected[bell] = deque()
+      self.bells[bell] = BellStriking(bell)
+    expected.append((row, place, slot, deadline))
+
+  def strike(self, bell, at):
+    ''' Match a strike by a human to where it should have been, None if it wasn't expected '''
+    expected = self._expected.get(bell)
+    if not expected:
+      return None
+    actual = self._actual or (lambda deadline: deadline)
+    # Skip the strikes this one is too late to be, the human missed them
+    while len(expected) > 1 and abs(actual(expected[1][3]) - at) < abs(actual(expected[0][3]) - at):
+      expected.popleft()
+      self.bells[bell].missed += 1
+    row, place, slot, deadline = expected.popleft()
+    deadline = actual(deadline)
+    error = at - deadline
+    self.bells[bell].add(error, self.tolerance, self._interval)
+    return StrikeMatch(row, place, slot, deadline, error)
+
+  def finish(self, now):
+    ''' The touch is over, strikes still expected that were due by now were missed '''
+    actual = self._actual or (lambda deadline: deadline)
+    for bell, expected in self._expected.items():
+      self.bells[bell].missed += sum(1 for e in expected if actual(e[3]) <= now)
+      expected.clear()
+
+  def report(self):
+    ''' One line per bell, times in milliseconds '''
+    lines = ['bell,strikes,mean_ms,sd_ms,early,late,out_of_place,missed']
+    for bell in sorted(self.bells):
+      b = self.bells[bell]
+      lines.append('{},{},{:.1f},{:.1f},{},{},{},{}'.format(bell, b.strikes, b.mean * 1000, b.sd() * 1000,
+                                                            b.early, b.late, b.out_of_place, b.missed))
+    return '\n'.join(lines) + '\n'
+
+  def write_report(self, directory, tower_id):
+    os.makedirs(directory, exist_ok = True)
+    file = os.path.join(directory, '{}-{}.csv'.format(tower_id, time.strftime('%Y%m%d-%H%M%S')))
+    with open(file, 'w') as f:
+      f.write(self.report())
+    return file
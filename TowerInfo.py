@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import urllib.parse
+import requests
+
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+class TowerInfo():
+  ''' What Ron needs to know about a tower before he can ring in it '''
+  def __init__(self, tower_id, name, server_ip = None, valid = True):
+    self.tower_id = tower_id
+    self.name = name
+    self.server_ip = server_ip
+    self.valid = valid
+
+  def __str__(self):
+    return '{} {}'.format(self.tower_id, self.name)
+
+class TowerInfoService():
+  ''' Looks up towers on RingingRoom, keeping what it finds on disk for a while
+
+  Lookups share one requests.Session so the connection to ringingroom.com is reused.
+  Towers found are kept in a JSON file with the time they were looked up, a lookup
+  within ttl seconds of that is answered without going to the web at all. Lookups
+  can be done in a pool of threads with a callback so the caller never waits
+  '''
+
+  URL = 'https://ringingroom.com'
+
+  def __init__(self, cache_file = None, ttl = 86400.0, workers = 4):
+    self._cache_file = cache_file
+    self._ttl = ttl
+    self._lock = Lock()
+    self._session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = workers)
+    self._session.mount('https://', adapter)
+    self._pool = ThreadPoolExecutor(workers, thread_name_prefix = 'tower-info')
+    # Lookups still running, so asking for the same tower twice only fetches it once
+    self._running = {}
+    self._entries = {}
+    self.hits = 0
+    self.misses = 0
+
+    if cache_file:
+      try:
+        with open(cache_file, 'r') as f:
+          self._entries = json.load(f)
+      except (OSError, ValueError):
+        # Missing or unreadable cache, it will be rebuilt
+        self._entries = {}
+
+  def from_config(config):
+    return TowerInfoService(config.get('TOWERS', 'cache', './data/towers.cache'),
+                            config.getfloat('TOWERS', 'ttl', 86400.0),
+                            config.getint('TOWERS', 'workers', 4))
+
+  def cached(self, tower_id):
+    ''' The tower if it was looked up recently enough, otherwise None '''
+    with self._lock:
+      entry = self._entries.get(str(tower_id))
+    if entry and time.time() - entry['at'] < self._ttl:
+      return TowerInfo(tower_id, entry['name'], entry['server_ip'])
+    return None
+
+  def lookup(self, tower_id):
+    ''' Blocks until the tower is known, use lookup_async from the GUI or an event loop '''
+    info = self.cached(tower_id)
+    if info:
+      self.hits += 1
+      return info
+    return self.lookup_async(tower_id).result()
+
+  def lookup_async(self, tower_id, callback = None):
+    ''' A future for the TowerInfo, callback is called with it on whichever thread finishes the lookup '''
+    info = self.cached(tower_id)
+    with self._lock:
+      if info:
+        self.hits += 1
+        future = self._pool.submit(lambda: info)
+      else:
+        future = self._running.get(tower_id)
+        if future is None:
+          self.misses += 1
+          future = self._pool.submit(self._fetch, tower_id)
+          self._running[tower_id] = future
+    if callback:
+      future.add_done_callback(lambda f: callback(TowerInfoService._result(tower_id, f)))
+    return future
+
+  def _result(tower_id, future):
+    ''' The TowerInfo from a finished lookup, an invalid one saying why if the lookup failed '''
+    try:
+      return future.result()
+    except Exception as e:
+      return TowerInfo(tower_id, 'Lookup failed: {}'.format(e), valid = False)
+
+  def close(self):
+    self._pool.shutdown(wait = False)
+    self._session.close()
+
+  def _fetch(self, tower_id):
+    try:
+      info = self._load(tower_id)
+      if info.valid:
+        with self._lock:
+          self._entries[str(tower_id)] = {'name': info.name, 'server_ip': info.server_ip, 'at': time.time()}
+        self._save()
+      return info
+    finally:
+      with self._lock:
+        self._running.pop(tower_id, None)
+
+  def _load(self, tower_id):
+    # Lots of interesting stuff in the tower parameters
+    url = urllib.parse.urljoin(TowerInfoService.URL, str(tower_id))
+    try:
+      response = self._session.get(url, timeout = 10.0)
+    except requests.RequestException:
+      return TowerInfo(tower_id, 'Unable to reach RingingRoom', valid = False)
+    if response.status_code != requests.codes.ok:
+      return TowerInfo(tower_id, 'No such tower', valid = False)
+
+    html = response.text
+    looking_for = 'window.tower_parameters = {'
+    ndx = html.find(looking_for)
+    if ndx < 0:
+      return TowerInfo(tower_id, 'No such tower', valid = False)
+    params = html[ndx + len(looking_for):]
+    try:
+      params = params[:params.index('}')]
+      return TowerInfo(tower_id, TowerInfoService._extract(params, 'name'), TowerInfoService._extract(params, 'server_ip'))
+    except ValueError:
+      return TowerInfo(tower_id, 'Unable to read the tower page', valid = False)
+
+  def _extract(params, id):
+    # Find the id, the string required will be in double quotes after a colon/space
+    ndx = params.index(id + ': "')
+    value = params[ndx + len(id) + 3:]
+    # Everything up to the closing double quote
+    ndx = value.index('"')
+    value = value[:ndx]
+
+    return value
+
+  def _save(self):
+    if not self._cache_file:
+      return
+    # Write to a temporary file and swap it in so a crash never leaves half a cache,
+    # the lock stops two lookups finishing together writing the same temporary file
+    with self._lock:
+      tmp = self._cache_file + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(self._entries, f)
+      os.replace(tmp, self._cache_file)
@@ -0,0 +1,144 @@
+''' Proves extents and touches true, that is no row is rung twice between the Go and That's all
+
+Every row is a short run of bytes so it is used directly as the key of a dict which
+records where it was first seen. One pass over the rows, linear in time and memory.
+
+A touch longer than the extent of its stage, such as a quarter of Doubles, has to repeat
+rows so it is reported as not provable as one block rather than as false.
+
+Run on its own it proves every extent in the library, a file per process:
+
+  python Truth.py [file.mcf ...]
+'''
+import sys
+import glob
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from Methods import Method, Extent
+
+class TruthReport():
+  def __init__(self, name, rows, first = None, second = None, row = None, provable = True):
+    self.name = name
+    # Number of rows proved
+    self.rows = rows
+    # False when there are more rows than the extent of the stage, so none of them were proved
+    self.provable = provable
+    # Indexes (from the first row after the Go) of the first pair of rows that are the same
+    self.first = first
+    self.second = second
+    self.row = row
+
+  def true(self):
+    return self.provable and self.first is None
+
+  def __str__(self):
+    if not self.provable:
+      return '{}: not provable as one block ({} rows, longer than the extent)'.format(self.name, self.rows)
+    if self.true():
+      return '{}: true ({} rows)'.format(self.name, self.rows)
+    return '{}: false, row {} repeats row {} ({})'.format(self.name, self.second + 1, self.first + 1,
+                                                          ''.join(str(b) for b in self.row))
+
+def provable(rows, bells):
+  ''' Whether that many rows on that many bells can be true, no longer than the extent '''
+  return rows <= math.factorial(bells)
+
+def prove_rows(name, rows, bells):
+  ''' Prove a buffer of rows laid end to end, bells bytes each '''
+  seen = {}
+  count = len(rows) // bells
+  if not provable(count, bells):
+    return TruthReport(name, count, provable = False)
+  for ndx in range(count):
+    row = bytes(rows[ndx * bells:(ndx + 1) * bells])
+    first = seen.setdefault(row, ndx)
+    if first != ndx:
+      return TruthReport(name, count, first, ndx, row)
+  return TruthReport(name, count)
+
+def prove(extent):
+  ''' Prove the rows of an Extent between the Go and That's all
+
+  A precomputed extent is proved straight from its store, otherwise the rows are
+  proved as they are generated so the whole touch is never built to prove it
+  '''
+  if not provable(extent.body_length, extent.number_of_bells):
+    return TruthReport(extent.name, extent.body_length, provable = False)
+  if extent.precomputed():
+    store = extent.compact()
+    block = store.block(extent.intro_length, extent.intro_length + extent.body_length)
+    return prove_rows(extent.name, block, extent.number_of_bells)
+
+  seen = {}
+  first_row = extent.intro_length
+  ndx = 0
+  for row in extent.rows():
+    if ndx >= first_row + extent.body_length:
+      break
+    if ndx >= first_row:
+      positions = bytes(row.positions)
+      first = seen.setdefault(positions, ndx - first_row)
+      if first != ndx - first_row:
+        return TruthReport(extent.name, extent.body_length, first, ndx - first_row, positions)
+    ndx += 1
+  return TruthReport(extent.name, extent.body_length)
+
+def touch_rows(method, definition, length = None, courses = 1):
+  ''' The rows of a calling such as 'PBPPB', rung courses times without cover, laid end to end '''
+  bells = method.number_of_bells()
+  rows = bytearray()
+  prev = bytes(range(1, bells + 1))
+  last_lead = Extent.LEAD_TYPE_PLAIN
+  engine = method.default_engine(definition)
+  for lead in definition.upper() * courses:
+    if lead not in (Extent.LEAD_TYPE_PLAIN, Extent.LEAD_TYPE_BOB, Extent.LEAD_TYPE_SINGLE):
+      continue
+    table = method.lead_table(last_lead, lead, False, engine)
+    lead_rows = bytes(table.gather(prev))
+    rows += lead_rows
+    if table.length:
+      prev = lead_rows[-bells:]
+    last_lead = lead
+  if length is not None:
+    rows = rows[:length * bells]
+  return rows
+
+def prove_touch(method, definition, length = None, courses = 1):
+  ''' Prove a composition given as a calling rather than an extent in the method file '''
+  return prove_rows(definition, touch_rows(method, definition, length, courses), method.number_of_bells())
+
+def prove_method(file):
+  ''' Prove every extent in a method file, mutable extents in every rotation '''
+  method = Method(file)
+  reports = []
+  extent_id = 1
+  while method.extent_exists(extent_id):
+    key = 'EXTENT-' + str(extent_id)
+    if method.extent_mutable(key):
+      rotations = itertools.product(*[range(len(s)) for s in Extent.sections(method, key)])
+      false = [r for r in (prove(Extent(method, key, cover = False, rotations = rotation)) for rotation in rotations) if not r.true()]
+      report = false[0] if false else prove(Extent(method, key, cover = False, rotations = [0] * len(Extent.sections(method, key))))
+      report.name += ' (mutable, {} false rotations)'.format(len(false))
+    else:
+      report = prove(Extent(method, key, cover = False))
+    reports.append(report)
+    extent_id += 1
+  return method.name, reports
+
+def prove_library(files, processes = None):
+  ''' Prove all the methods, one file per process '''
+  with ProcessPoolExecutor(processes) as pool:
+    return list(pool.map(prove_method, files))
+
+if __name__ == '__main__':
+  files = sys.argv[1:] if len(sys.argv) > 1 else sorted(glob.glob('./data/*.mcf'))
+  false = 0
+  for name, reports in prove_library(files):
+    print(name)
+    for report in reports:
+      print('  ' + str(report))
+      if report.provable and not report.true():
+        false += 1
+  sys.exit(1 if false else 0)
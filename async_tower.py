@@ -0,0 +1,443 @@
+import asyncio
+import socketio
+
+from Config import Config
+from ExtentCache import ExtentCache
+from Latency import LatencyEstimator
+from Pacing import PaceFollower
+from Striking import StrikingIndex
+from Scheduler import Scheduler
+from Sender import StrikePayloads, StrikeSender
+from StrikeLog import StrikeLog
+from Metrics import TowerMetrics, Profiler
+
+class TowerListener:
+  ''' Told about changes in Ron's state, override whichever are of interest '''
+  def waiting_for_look_to(self, tower):
+    pass
+
+  def ringing(self, tower):
+    pass
+
+  def extent_proved(self, tower, report):
+    pass
+
+  def striking_report(self, tower, report):
+    pass
+
+  def stood_back(self, tower, source):
+    pass
+
+class AsyncTower:
+  ''' Ron's ringing engine, every tower is a coroutine so one event loop can ring in lots of towers '''
+  def __init__(self, info, listener = None, extents = None):
+    ''' info is the TowerInfo for the tower, looked up beforehand by a TowerInfoService,
+    extents is an ExtentCache which can be shared between towers '''
+    self.tower_id = info.tower_id
+    self.name = info.name
+    self._load_balancing_url = info.server_ip
+    self._valid = info.valid
+    self._listener = listener if listener else TowerListener()
+    self._client = None
+    self._connect_lock = asyncio.Lock()
+    # In the tower between c_join and c_user_left, a reconnect has to join again
+    self._joined = False
+    self._ron = None
+    self._method = None
+    self._extent = None
+    self._bell_assignments = {}
+    # Look to from the tower and Ron being stood down, for whatever reason, wake the
+    # ringing straight away rather than being polled for
+    self._look_to = asyncio.Event()
+    self._look_to_at = None
+    self._stopped = asyncio.Event()
+    # Clear while ron() is running, close() waits on it so Ron always says goodbye
+    self._finished = asyncio.Event()
+    self._finished.set()
+    self._ron_called_thats_all = False
+    self._ron_called_stand_next = False
+    self._pace = 3.0
+    self._scheduler = None
+    self._sender = None
+    self._payloads = None
+    self.truth = None
+    config = Config()
+    self._extents = extents if extents else ExtentCache.from_config(config)
+    self._latency = LatencyEstimator(config.getboolean('LATENCY', 'compensate', True),
+                                     config.getfloat('LATENCY', 'max_lead', 0.25),
+                                     config.getfloat('LATENCY', 'max_step', 0.005))
+    self._pacing = PaceFollower(config.getboolean('PACING', 'follow', True),
+                                config.getfloat('PACING', 'alpha', 0.1),
+                                config.getfloat('PACING', 'bounds', 0.15),
+                                config.getfloat('PACING', 'max_step', 0.01))
+    self._striking = StrikingIndex(config.getfloat('REPORTS', 'tolerance', 0.05))
+    self._reports = config.get('REPORTS', 'directory', '')
+    self._keep_strike_log = config.getboolean('REPORTS', 'strike_log', False)
+    # Everything sent in the last touch, if asked for
+    self.strike_log = None
+    self.metrics = TowerMetrics(config.getint('METRICS', 'buffer', 4096))
+    self._profiler = Profiler.from_config(config)
+    self._reconnect_delay = config.getfloat('CONNECTION', 'reconnect_delay', 1.0)
+    self._reconnect_delay_max = config.getfloat('CONNECTION', 'reconnect_delay_max', 30.0)
+    self._connect_attempts = config.getint('CONNECTION', 'connect_attempts', 5)
+    # Connection metrics
+    self.connects = 0
+    self.reconnects = 0
+    self.disconnects = 0
+    self.connect_failures = 0
+    self.connect_time = None
+    self.dropped = 0
+
+  # Time from 'Look to' being called to the first strike, the audio has to play
+  LOOK_TO_DELAY = 2.8
+
+  # How many other shuffles of a mutable extent are tried when the first one is false
+  SHUFFLE_ATTEMPTS = 20
+
+  # How long close() waits for Ron to finish ringing and leave the tower
+  CLOSE_TIMEOUT = 5.0
+
+  def add_method_extent(self, method, extent_id, add_cover):
+    self._method = method
+    # The extent comes already generated and proved, so unlike a bare Extent it is all in
+    # memory before the first strike. If a shuffle of a mutable extent is false try a few
+    # more in the hope of finding a true one, unless it is too long to prove
+    with self._profiler.profile('extent-{}'.format(self.tower_id)):
+      self._extent, self.truth = self._extents.extent(method, extent_id, add_cover)
+      attempts = 0
+      tried = set()
+      while self.truth.provable and not self.truth.true() and self._extent.rotations is not None and attempts < AsyncTower.SHUFFLE_ATTEMPTS:
+        # Each retry asks for a shuffle that hasn't been tried yet
+        tried.add(self._extent.rotations)
+        self._extent, self.truth = self._extents.extent(method, extent_id, add_cover, exclude = tried)
+        attempts += 1
+    self._listener.extent_proved(self, self.truth)
+    self._payloads = StrikePayloads(self.tower_id, self._extent.number_of_bells)
+    self._bell_assignments = {}
+    for ndx in range(self._extent.number_of_bells):
+      self._bell_assignments[ndx + 1] = None
+
+  def remove_method_extent(self):
+    self._method = None
+    self._extent = None
+
+  def set_pace(self, pace):
+    self._pace = pace
+    if self._scheduler:
+      self._scheduler.set_pace(pace)
+      self._pacing.set_nominal(pace / self._extent.number_of_bells)
+      self._striking.set_interval(pace / self._extent.number_of_bells)
+
+  def prepare(self):
+    ''' Reset the flags ready for the next call of ron '''
+    self._stopped.clear()
+    self._look_to.clear()
+    self._look_to_at = None
+    self._ron_called_thats_all = False
+    self._ron_called_stand_next = False
+    self._striking.start(None)
+
+  def stand_down(self):
+    self._stopped.set()
+
+  def is_ron_ready(self):
+    return not self._stopped.is_set()
+
+  async def ron(self):
+    # The connection is left open afterwards ready for the next touch
+    self._finished.clear()
+    try:
+      await self.connect()
+      await self._ring()
+    finally:
+      self._joined = False
+      self._finished.set()
+
+  async def _ring(self):
+    # Get list of assigned ropes
+    await self._announce()
+
+    # Set to hand stroke so we have a consistent start
+    await self._set_to_handstroke()
+
+    # Wait for 'Look To' from Ringing Room or Ron being told to stand down
+    self._listener.waiting_for_look_to(self)
+    if await self._wait_for_look_to():
+      # The first strike is a fixed time after 'Look to' was heard, not after Ron got round to noticing
+      start = self._look_to_at + AsyncTower.LOOK_TO_DELAY
+      if await self._pause_until(start):
+        # cProfile can't follow one task, everything on the event loop (other towers
+        # included) is profiled while this tower rings and the file is named to say so
+        with self._profiler.profile('event-loop-while-ringing-{}'.format(self.tower_id)):
+          await self._ring_extent(start)
+
+    await self._farewell()
+
+  async def _wait_for_look_to(self):
+    ''' True once 'Look to' has been called, False if Ron is stood down first '''
+    look_to = asyncio.ensure_future(self._look_to.wait())
+    stopped = asyncio.ensure_future(self._stopped.wait())
+    try:
+      await asyncio.wait((look_to, stopped), return_when = asyncio.FIRST_COMPLETED)
+    finally:
+      look_to.cancel()
+      stopped.cancel()
+    return not self._stopped.is_set()
+
+  async def _pause_until(self, when):
+    ''' Sleep until when on the loop's clock, False if Ron is stood down first '''
+    try:
+      await asyncio.wait_for(self._stopped.wait(), max(0.0, when - asyncio.get_running_loop().time()))
+      return False
+    except asyncio.TimeoutError:
+      return not self._stopped.is_set()
+
+  async def _ring_extent(self, start):
+    self._listener.ringing(self)
+
+    # Deadlines are on the event loop's clock which is monotonic
+    self._scheduler = Scheduler(self._pace, self._extent.number_of_bells, clock = asyncio.get_running_loop().time)
+    self._scheduler.start(start)
+    self._pacing.start(self._scheduler, self._scheduler.interval())
+    self._striking.start(self._scheduler.interval(), self._scheduler.actual_deadline)
+
+    # The ringing loop only works out what to send and when, the sender does the sending
+    # so a slow emit never holds up working out the next strike
+    self._latency.reset()
+    self.strike_log = StrikeLog() if self._keep_strike_log else None
+    self._sender = StrikeSender(self._send, self._scheduler, self._extent.number_of_bells * 2, self._stopped, self._latency,
+                                self.strike_log, self.metrics)
+    sender = asyncio.create_task(self._sender.run())
+    try:
+      stroke = False
+      # Rows are generated a lead at a time as they are needed
+      for row_ndx, row in enumerate(self._extent):
+        if self._stopped.is_set():
+          break
+
+        stroke = not stroke
+        self.metrics.rows += 1
+
+        # Handle handstroke gap
+        if stroke:
+          self._scheduler.handstroke_gap()
+
+        calls_handled = False
+        for place, strike in enumerate(row.positions):
+          if self._stopped.is_set():
+            break
+
+          deadline = self._scheduler.next_strike()
+
+          # Calls go out just before the first bell of the row
+          if not calls_handled:
+            await self._handle_calls(row, deadline)
+            calls_handled = True
+
+          if not self._bell_assignments[strike]:
+            await self._sender.put(deadline, 'c_bell_rung', self._payloads.strike(strike, stroke))
+          else:
+            # Where the human should ring is indexed as the row is rung
+            self._striking.expect(strike, row_ndx, place, self._scheduler.slot - 1, deadline)
+
+      await self._sender.finish()
+      await sender
+    finally:
+      sender.cancel()
+      self._pacing.stop()
+
+  async def _handle_calls(self, row, deadline):
+    if row.call_go:
+      await self._call('Go', deadline)
+    if row.call_bob:
+      await self._call('Bob', deadline)
+    if row.call_single:
+      await self._call('Single', deadline)
+    if row.call_thats_all:
+      self._ron_called_thats_all = True
+      await self._call("That's all", deadline)
+    if row.call_stand:
+      self._ron_called_stand_next = True
+      await self._call('Stand next', deadline)
+
+  async def _call(self, call, deadline):
+    await self._sender.put(deadline, 'c_call', self._payloads.call(call), strike = False)
+
+  def log_strikes(self, keep = True):
+    ''' Keep a StrikeLog of the next touches whatever ringingron.ini says '''
+    self._keep_strike_log = keep
+
+  def latency_stats(self):
+    ''' How long the round trip to the server is and how early strikes are sent to make up for it '''
+    return self._latency.stats()
+
+  def pacing_stats(self):
+    ''' The interbell interval the humans are ringing at and the one Ron is using '''
+    return self._pacing.stats()
+
+  def ron_in_tower(self):
+    return self._ron is not None
+
+  def valid(self):
+    return self._valid
+
+  def connection_stats(self):
+    ''' How long the connection took to set up and how often it has had to be made again '''
+    return {'connected': self._client is not None and self._client.connected,
+            'connect_time': self.connect_time,
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'disconnects': self.disconnects,
+            'connect_failures': self.connect_failures,
+            'dropped': self.dropped}
+
+  async def connect(self):
+    ''' Open the connection to the tower's server, it is kept open across touches until close
+
+    Once connected socketio reconnects by itself with backoff after a drop, only the
+    first connection is retried here
+    '''
+    async with self._connect_lock:
+      if self._client is not None:
+        return
+      client = self._new_client()
+      # Handlers are registered once for the life of the connection
+      client.on('connect', self._on_connect)
+      client.on('disconnect', self._on_disconnect)
+      client.on('s_assign_user', self._on_assign_user)
+      client.on("s_call", self._on_call)
+      client.on("s_user_left", self._on_user_left)
+      client.on('s_bell_rung', self._on_bell_rung)
+
+      loop = asyncio.get_running_loop()
+      delay = self._reconnect_delay
+      attempt = 1
+      while True:
+        start = loop.time()
+        try:
+          await client.connect(self._load_balancing_url)
+          break
+        except socketio.exceptions.ConnectionError:
+          self.connect_failures += 1
+          if attempt >= self._connect_attempts:
+            raise
+          await asyncio.sleep(delay)
+          delay = min(delay * 2, self._reconnect_delay_max)
+          attempt += 1
+      self.connect_time = loop.time() - start
+      self._client = client
+
+  def _new_client(self):
+    return socketio.AsyncClient(reconnection = True,
+                                reconnection_delay = self._reconnect_delay,
+                                reconnection_delay_max = self._reconnect_delay_max)
+
+  async def close(self, timeout = CLOSE_TIMEOUT):
+    ''' Done with the tower altogether, Ron is stood down and left to finish his farewell first '''
+    self.stand_down()
+    try:
+      await asyncio.wait_for(self._finished.wait(), timeout)
+    except asyncio.TimeoutError:
+      pass
+    async with self._connect_lock:
+      if self._client is None:
+        return
+      client = self._client
+      self._client = None
+      await client.disconnect()
+
+  async def _on_connect(self):
+    self.connects += 1
+    if self.connects > 1:
+      self.reconnects += 1
+    if self._joined:
+      # Back after a drop part way through a touch, the server has forgotten Ron
+      await self._send("c_join", {"anonymous_user": True, "tower_id": self.tower_id})
+      await self._send('c_request_global_state', {"tower_id": self.tower_id})
+
+  def _on_disconnect(self):
+    self.disconnects += 1
+
+  async def _announce(self):
+    ''' Ron announces himself and asks for current state of play '''
+    await self._send("c_join", {"anonymous_user": True, "tower_id": self.tower_id})
+    await self._send('c_request_global_state', {"tower_id": self.tower_id})
+    self._joined = True
+
+    # Make sure we have the right number of bells
+    await self._send('c_size_change', {'new_size': self._extent.number_of_bells, 'tower_id': self.tower_id})
+    self._look_to.clear()
+
+  async def _farewell(self):
+    ''' Ron is off to the pub '''
+    self._stand_back_ron('Finished')
+    self._striking.finish(asyncio.get_running_loop().time())
+    if self._striking.bells:
+      self._listener.striking_report(self, self._striking.report())
+      if self._reports:
+        # Keep the file writing off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._striking.write_report, self._reports, self.tower_id)
+    if self.strike_log and self._reports:
+      await asyncio.get_running_loop().run_in_executor(None, self.strike_log.write_log, self._reports, self.tower_id)
+    await self._send('c_user_left', {'tower_id': self.tower_id})
+    self._joined = False
+
+  def _on_call(self, data):
+    if data['call'] == 'Look to':
+      if not self._look_to.is_set():
+        self._look_to_at = asyncio.get_running_loop().time()
+        self._look_to.set()
+    elif data['call'] == "That's all":
+      if not self._ron_called_thats_all:
+        self._stand_back_ron("That's all from tower")
+    elif data['call'] == 'Stand next':
+      if not self._ron_called_stand_next:
+        self._stand_back_ron('Stand next from tower')
+
+  def _on_bell_rung(self, data):
+    bell = data.get('who_rang')
+    now = asyncio.get_running_loop().time()
+    if self._bell_assignments.get(bell):
+      # The humans' strikes are measured against where they should be and tell Ron
+      # how fast the band is ringing. They are heard a one way trip after they are rung
+      match = self._striking.strike(bell, now - self._latency.lead())
+      if match:
+        self._pacing.strike(match.slot, now)
+    else:
+      # Ron's own strikes coming back give the round trip time to the server
+      self._latency.echo(bell, now)
+
+  def _on_assign_user(self, data):
+    if data['user']:
+      self._bell_assignments[data['bell']] = data['user']
+    else:
+      self._bell_assignments[data['bell']] = None
+
+  def _on_user_left(self, data):
+    ''' Should get this singal when Ron leaves but not happening '''
+    pass
+
+  async def _set_to_handstroke(self):
+    await self._send("c_set_bells", {"tower_id": self.tower_id})
+
+  def _stand_back_ron(self, source):
+    self._listener.stood_back(self, source)
+    self.metrics.stood_back(source)
+    self._stopped.set()
+
+  async def _send(self, event, data):
+    # Anything sent while the connection is down is lost rather than held up, a strike
+    # sent late after a reconnect would be worse than no strike at all
+    if self._client is None or not self._client.connected:
+      self.dropped += 1
+      return
+    try:
+      await self._client.emit(event, data)
+    except socketio.exceptions.SocketIOError:
+      self.dropped += 1
+
+async def ring_towers(towers):
+  ''' Ring in several towers at once on the current event loop, the connections are left open '''
+  for tower in towers:
+    tower.prepare()
+  await asyncio.gather(*[tower.ron() for tower in towers])
@@ -1,209 +1,96 @@
-import urllib
-import requests
+import asyncio
+import concurrent.futures
 
-import socketio
+from threading import Thread, Lock
 
-from threading import Thread
-from time import sleep
+from async_tower import AsyncTower
 
-import PySimpleGUI as sg
+class Tower:
+  ''' Threaded front end for the GUI, the ringing itself is done by an AsyncTower on a shared event loop '''
 
-from Methods import Method, Extent
+  _loop = None
+  _loop_lock = Lock()
+
+  def __init__(self, info, listener, extents = None):
+    self.tower_id = info.tower_id
+    self._engine = AsyncTower(info, listener, extents)
+    self.name = self._engine.name
+    self.metrics = self._engine.metrics
+    self._future = None
+    if self.valid():
+      # Connect now so the first 'Look To Ron' doesn't wait for it, if this fails
+      # it is tried again when Ron is woken up
+      asyncio.run_coroutine_threadsafe(self._engine.connect(), Tower._event_loop())
+
+  def _event_loop():
+    # One event loop in a background thread is shared by every tower in the process
+    with Tower._loop_lock:
+      if Tower._loop is None:
+        Tower._loop = asyncio.new_event_loop()
+        Thread(target = Tower._loop.run_forever, daemon = True).start()
+    return Tower._loop
 
-class Tower:
-  def __init__(self, tower_id, gui):
-    self.tower_id = tower_id
-    self._gui = gui
-    self._load_tower_info(tower_id)
-    self._client = None
-    self._ron = None
-    self._method = None
-    self._extent = None
-    self._bell_assignments = {}
-    self._stop_ron = False
-    self._thread = None
-    self._look_to_called = False
-    self._pace = 3.0
-    
   def add_method_extent(self, method, extent_id, add_cover):
-    self._method = method
-    self._extent = Extent(method, extent_id, cover = add_cover)
-    self._bell_assignments = {}
-    for ndx in range(self._extent.number_of_bells):
-      self._bell_assignments[ndx + 1] = None
-  
+    self._engine.add_method_extent(method, extent_id, add_cover)
+
   def remove_method_extent(self):
-    self._method = None
-    self._extent = None
-    
+    self._engine.remove_method_extent()
+
   def set_pace(self, pace):
-    self._pace = pace
-  
+    self._engine.set_pace(pace)
+
   def wait_for_look_to(self):
-    self._stop_ron = False
-    self._look_to_called = False
-    self._ron_called_thats_all = False
-    self._ron_called_stand_next = False
-    self._thread = Thread(target = Tower.ron, args = (self, ))
-    self._thread.start()
-  
+    self._engine.prepare()
+    self._future = asyncio.run_coroutine_threadsafe(self._engine.ron(), Tower._event_loop())
+
+  def join(self, timeout = None):
+    ''' Wait for Ron to finish ringing, True if he has '''
+    if self._future is None:
+      return True
+    try:
+      self._future.result(timeout)
+    except concurrent.futures.TimeoutError:
+      return False
+    return True
+
   def stand_down(self):
-    self._stop_ron = True
-  
+    Tower._event_loop().call_soon_threadsafe(self._engine.stand_down)
+
+  def close(self, timeout = None):
+    ''' Stand Ron down, wait for him to leave the tower and drop the connection, True if he has
+
+    The shared loop runs on a daemon thread so this has to be waited on before exiting.
+    timeout defaults to a little longer than the engine waits for Ron's farewell
+    '''
+    if timeout is None:
+      timeout = AsyncTower.CLOSE_TIMEOUT + 1.0
+    future = asyncio.run_coroutine_threadsafe(self._engine.close(), Tower._event_loop())
+    try:
+      future.result(timeout)
+    except concurrent.futures.TimeoutError:
+      return False
+    return True
+
   def is_ron_ready(self):
-    return not self._stop_ron
-    
-  def ron(tower):
-    tower.enter()
-    
-    # Get list of assigned ropes
-    tower._announce()
-    
-    # Set to hand stroke so we have a consistent start
-    tower._set_to_handstroke()
-    
-    # Wait for 'Look To' from Ringing Room or Ron being told to stand down
-    while tower.is_ron_ready() and not tower._look_to_called:
-      sleep(0.1)
-    
-    # 'Look to' has been called, give it time to play the audio
-    sleep(2.8)
-    
-    stroke = False
-    for row in tower._extent.rows:
-      if tower._stop_ron:
-        break
-        
-      stroke = not stroke
-      
-      # Handle handstroke gap
-      if stroke:
-        sleep(tower._pace / tower._extent.number_of_bells)
-        
-      tower._handle_calls(row)
-      
-      for strike in row.positions:
-        if tower._stop_ron:
-          break
-          
-        if not tower._bell_assignments[strike]:
-          tower._send('c_bell_rung', {'bell': strike, 'tower_id': tower.tower_id, 'stroke': stroke})
-        sleep(tower._pace / tower._extent.number_of_bells)
-    
-    tower._bell_asignments = {}
-    
-    tower._farewell()
-    
-    tower.leave()
-    
-  def _handle_calls(self, row):
-    if row.call_go:
-      self._call('Go')
-    if row.call_bob:
-      self._call('Bob')
-    if row.call_single:
-      self._call('Single')
-    if row.call_thats_all:
-      self._ron_called_thats_all = True
-      self._call("That's all")
-    if row.call_stand:
-      self._ron_called_stand_next = True
-      self._call('Stand next')
-    
-  def _call(self, call):
-    self._send('c_call', {'call': call, 'tower_id': self.tower_id})
-  
+    return self._engine.is_ron_ready()
+
   def ron_in_tower(self):
-    return self._ron is not None
-  
+    return self._engine.ron_in_tower()
+
   def valid(self):
-    return self._valid
-    
-  def enter(self):
-    # connect socketio etc
-    self._client = socketio.Client()
-    self._client.connect(self._load_balancing_url)
-
-    self._client.on('s_assign_user', self._on_assign_user)
-    self._client.on("s_call", self._on_call)
-    self._client.on("s_user_left", self._on_user_left)
-    
-  def leave(self):
-    # Give it a bit of time to receive any messages resulting from telling the server Ron is leaving
-    sleep(0.1)
-    
-    self._client.disconnect()
-    self._client = None
-  
-  def _announce(self):
-    ''' Ron announces himself and asks for current state of play '''
-    self._send("c_join", {"anonymous_user": True, "tower_id": self.tower_id})
-    self._send('c_request_global_state', {"tower_id": self.tower_id})
-    
-    # Make sure we have the right number of bells
-    self._send('c_size_change', {'new_size': self._extent.number_of_bells, 'tower_id': self.tower_id})
-    self._look_to_called = False
-    
-  def _farewell(self):
-    ''' Ron is off to the pub '''
-    self._stand_back_ron()
-    self._send('c_user_left', {'tower_id': self.tower_id})
-    
-  def _on_call(self, data):
-    if data['call'] == 'Look to':
-      self._look_to_called = True
-    elif data['call'] == "That's all":
-      if not self._ron_called_thats_all:
-        self._stand_back_ron()
-    elif data['call'] == 'Stand next':
-      if not self._ron_called_stand_next:
-        self._stand_back_ron()
-
-  def _on_assign_user(self, data):
-    if data['user']:
-      self._bell_assignments[data['bell']] = data['user']
-    else:
-      self._bell_assignments[data['bell']] = None
-  
-  def _on_user_left(self, data):
-    ''' Should get this singal when Ron leaves but not happening '''
-    pass
-
-  def _set_to_handstroke(self):
-    self._send("c_set_bells", {"tower_id": self.tower_id})
-  
-  def _stand_back_ron(self):
-    self._gui.write_event_value('-Ron Stands Back-', 'Call from tower')
-    self._stop_ron = True
-  
-  def _load_tower_info(self, tower_id):
-    # Lots of interesting stuff in the tower parameters
-    url = urllib.parse.urljoin('https://ringingroom.com', str(tower_id))
-    response = requests.get(url)
-    if response.status_code == requests.codes.ok:
-      html = response.text
-      looking_for = 'window.tower_parameters = {'
-      ndx = html.index(looking_for)
-      params = html[ndx + len(looking_for):]
-      ndx = params.index('}')
-      params = params[:ndx]
-      self.name = Tower._extract(params, 'name')
-      self._load_balancing_url = Tower._extract(params, 'server_ip')
-      self._valid = True
-    else:
-      self.name = 'No such tower'
-      self._load_balancing_url = None
-      self._valid = False
-    
-  def _extract(params, id):
-    # Find the id, the string required will be in double quotes after a colon/space
-    ndx = params.index(id + ': "')
-    value = params[ndx + len(id) + 3:]
-    # Everything up to the closing double quote
-    ndx = value.index('"')
-    value = value[:ndx]
-    
-    return value
-
-  def _send(self, event, data):
-    self._client.emit(event, data)
+    return self._engine.valid()
+
+  def log_strikes(self, keep = True):
+    self._engine.log_strikes(keep)
+
+  def strike_log(self):
+    return self._engine.strike_log
+
+  def latency_stats(self):
+    return self._engine.latency_stats()
+
+  def pacing_stats(self):
+    return self._engine.pacing_stats()
+
+  def connection_stats(self):
+    return self._engine.connection_stats()